@@ -1,378 +1,1201 @@
-""" 
-This script is for uploading photoes and videos from the given _folder_ into amazon cloud.
-The upload method is the following:
-Step1. Selecting all the files from the _folder_ which will be uploaded (not uploaded yet)
-Step2. Create a new album if hasn't existed yet
-Step3. Update the album by file by file:
-Step3a. Upload the file
-Step3b. Upload thumbnail
-Step3c. Write photo data into the amazon config file
-Step 3d. Write photo data (hash code) into the hash file (local file in the _folder_)
-"""
-from fileInfo import *
-from thumbnails import *
-import boto3, botocore
-import os, sys, hashlib
-import configparser
-import threading
-import json
-from datetime import datetime
-
-print('Connect to s3')
-s3 = boto3.resource('s3')
-base_bucket_name = "photos.pataky."
-hash_file=".amazonUploader" #file contains albumname and file-hash pairs
-json_file = "photos.json"
-hash_photos = "Photos"
-hash_album = "Album"
-hash_prefix = "sha256_"
-frontend_files = [{"name": "index.html", "type": "text/html"}, 
-                {"name": "style.css", "type": "text/css"}, 
-                {"name": "gallery.js", "type": "text/javascript"},
-                {"name": "noThumbnail.jpg", "type": "image/jpeg"},
-                {"name": "000video_bcgrd_0002.png", "type": "image/png"}]
-
-def get_diff_of_lists(listA, listB):
-    return list(set(listA) - set(listB))
-
-def calculate_hash_of_file(filepath):
-    ''' Calculates the Hash code of the file.'''
-    hasher = hashlib.sha256()
-    with open(filepath, 'rb') as afile:
-        buffer = afile.read()
-        hasher.update(buffer)
-    return (hasher.hexdigest())
-
-def get_photo_data(path, file_name):
-    """Sets photo data for the given file."""
-    file_path = os.path.join(path, file_name)
-    upload_data = {'src': file_name,
-            'type': 'vid' if is_video_file(file_name) else 'img',
-            'thumbnail': get_thumbnail_name(file_name),
-            }
-    data = {'upload_data': upload_data,
-            'filename': file_name,
-            'source': file_path,
-            'dirname': path,
-            'hash': calculate_hash_of_file(file_path)}
-    file_info = get_file_info(file_path, file_name)
-    data['upload_data'].update(file_info)
-    return data
-
-def clear_hash_data(path):
-    config_path = os.path.join(path, hash_file)
-    if is_valid_path(config_path):
-        f = open(config_path, 'r+')
-        f.truncate(0)
-
-def get_config_options_for_section(path, config, section):
-    """Returns options for the givem section from the config file.
-        If the file demaged, the content of it will be deleted."""
-    result = {}
-    config_path = os.path.join(path, hash_file)
-    if not is_valid_path(config_path):
-        return result
-    try:
-        config = configparser.ConfigParser()
-        config.read(config_path)
-        if section not in config.sections():
-            return {}
-        options = config.options(section)
-        for option in options:
-            try:
-                result[option.lower()] = (config.get(section, option)).lower()
-            except Exception as e:
-                #Corrupt hash_file -> clear it
-                clear_hash_data(path)
-    except configparser.MissingSectionHeaderError as mse:
-        #Corrupt hash_file -> clear it
-        clear_hash_data(path)
-    return result
-
-def read_hash_from_config(path):
-    """Reads the (filename, hash_code) pairs from config file"""
-    config = configparser.ConfigParser()
-    return get_config_options_for_section(path, config, hash_photos)
-
-def read_album_from_config(path):
-    """Reads amazon albumname for the given path from config file
-        If there is no albumname, it returns empty string"""
-    config = configparser.ConfigParser({hash_album: ""})
-    options = get_config_options_for_section(path, config, hash_album)
-    return options.get(hash_album.lower(), "")
-
-def append_to_hash_file(path, section, option, value):
-    """"Saves the given option with the given value under
-        the given sectioninto the config file.
-        If the config file doesn't exist, it creates it.
-        If the given section doesn't exist, it adds to the file."""
-    config_path = os.path.join(path, hash_file)
-    config = configparser.ConfigParser()
-
-    if not is_valid_path(config_path):
-        config.add_section(section)
-    else:
-        config.read(config_path)
-        if section not in config.sections():
-            config.add_section(section)
-    config.set(section, option, value)
-    with open(config_path, 'w') as configfile:
-        config.write(configfile)
-
-def get_album_name(path, album):
-    """ Returns the album_name. The rules:
-        First check the config file. If the album is set-it will use it.
-        If not, use the given album parameter """
-    album_name = read_album_from_config(path)
-    return album_name if album_name else album
-
-def get_uploaded_file_names(path):
-    hash_name_pairs = read_hash_from_config(path)
-    return [file_name.lower() for file_name in list(hash_name_pairs)]
-
-def get_uploadable_files(path, is_valid_album):
-    all_files = get_media_files(path)
-    uploaded = []
-    if is_valid_album:
-        uploaded = get_uploaded_file_names(path)
-    else:
-        clear_hash_data(path)
-    return get_diff_of_lists(all_files, uploaded)
-
-class ProgressPercentage(object):
-    def __init__(self, file_name):
-        self._filename = file_name
-        self._size = os.path.getsize(file_name)
-        self._lock = threading.Lock()
-        self._uploaded = 0
-
-    def byte_to_kB(self, source):
-        return str(round(source /1024)) + 'kB'
-
-    def __call__(self, bytes_amount):
-        with self._lock:
-            self._uploaded += bytes_amount
-            percentage = (self._uploaded * 100) / self._size
-            sys.stdout.write("\r%s  %s/ %s (%.2f%%)" % (
-                'Uploading %s:' % self._filename,
-                self.byte_to_kB(self._uploaded),
-                self.byte_to_kB(self._size),
-                percentage))
-            sys.stdout.flush()
-
-class AmazonUploader():
-    def get_bucket_name_for_album(self, album_name):
-        return base_bucket_name + album_name
-
-    def is_valid_bucket(self, album_name):
-        result = True
-        bucket_name = self.get_bucket_name_for_album(album_name)
-        try:
-            s3.meta.client.head_bucket(Bucket = bucket_name)
-        except botocore.client.ClientError as e:
-            error_code = e.response['Error']['Code']
-            if error_code == '404':
-                result = False
-        return result
-
-    def is_key_exists(self, album_name, key):
-        bucket_name = self.get_bucket_name_for_album(album_name)
-        if self.get_key_metadata(bucket_name, key):
-            return True
-        else:
-             return False
-
-    def get_key_metadata(self, bucket_name, key):
-        result = None
-        try:
-            result = s3.meta.client.head_object(Bucket = bucket_name, Key = key)
-        except botocore.client.ClientError as e:
-            error_code = e.response['Error']['Code']
-            if error_code == '404':
-                result = None
-        return result
-
-    def is_json_exists(self, album_name):
-        return self.is_key_exists(album_name, json_file)
-
-    def get_all_uploadable_files(self, path, album_name):
-        """Retruns all uploadable files from the given path"""
-        print("Get photos and videos for uploading...")
-        is_valid_album = self.is_valid_bucket(album_name)
-        return get_uploadable_files(path, is_valid_album)
-
-    def add_to_json(self, json_content, new_data):
-        #first remove from json file is already exist the file
-        json_content = [i for i in json_content if i['src'] != new_data['src']]
-        json_content.append(new_data)
-        return json_content
-
-    def append_to_amazon_config(self, album_name, photo_records):
-        bucket_name = self.get_bucket_name_for_album(album_name)
-        json_object = s3.Object(bucket_name, json_file)
-
-        if not self.is_json_exists(album_name):
-            #if json file doesn't exist - create with the given photo data
-            json_content = []
-        else:
-            #if json file exists - read-append-sort-save
-            file_content = json_object.get()['Body'].read().decode('utf-8')
-            json_content = json.loads(file_content)
-        
-        #add photo data to json file
-        for data in photo_records:
-            json_content = self.add_to_json(json_content, data)
-        sorted_content = sorted(json_content, key = lambda k: k.get('date_taken', 0), reverse = True)
-        json_object.put(ACL= 'public-read', Body = json.dumps(sorted_content, ensure_ascii = False))
-
-    def append_photo_data_to_amazon_config(self, album_name, photo_data):
-        self.append_to_amazon_config(album_name, [photo_data.get('upload_data')])
-
-    def upload_photo(self, photo_data, bucket_name):
-        try:
-            result =  s3.meta.client.upload_file(Filename = photo_data['source'],
-                Bucket = bucket_name, Key = photo_data['filename'],
-                ExtraArgs = {'ACL': 'public-read'},
-                Callback = ProgressPercentage(photo_data['filename']))
-            print('\n')
-        except botocore.client.ClientError as e:
-            return False
-        return True
-
-    def upload_photo_thumbnail(self, photo_path, photo_name, thumbnail_name, bucket_name):
-        try:
-            thumbnail = generate_thubnail(photo_path, photo_name)
-            result =  s3.meta.client.upload_fileobj(Fileobj = thumbnail,
-                Bucket = bucket_name, Key = thumbnail_name,
-                ExtraArgs = {'ACL': 'public-read'})
-        except botocore.client.ClientError as e:
-            return False
-        return True
-
-    def upload_thumbnail(self, photo_data, bucket_name):
-        return self.upload_photo_thumbnail(photo_data['source'], photo_data['filename'], photo_data['upload_data']['thumbnail'], bucket_name)
-
-    def update_bucket(self, path, album_name):
-        print('Update album: %s \n' % album_name)
-
-        file_names = self.get_all_uploadable_files(path, album_name)
-        print('New files: %d \n' % (len(file_names)))
-
-        #update bucket
-        amazon_bucket_name = self.get_bucket_name_for_album(album_name)
-        if file_names:
-            #checks if the album name is in configfile. If not, put it in
-            append_to_hash_file(
-                    path,
-                    hash_album,
-                    hash_album,
-                    album_name)
-        index = 0
-        nr_of_files = len(file_names)
-        for file_name in file_names:
-            index += 1
-            print('%d/%d:' % (index, nr_of_files))
-            #upload photos one by one and add hash to the config file
-            file_data = get_photo_data(path, file_name)
-            if self.upload_photo(file_data, amazon_bucket_name) and self.upload_thumbnail(file_data, amazon_bucket_name):
-                self.append_photo_data_to_amazon_config(album_name, file_data)
-                append_to_hash_file(path, hash_photos, file_name, file_data['hash'])
-            else:
-                print('\n Upload failed')
-
-    def update_frontend_files(self, bucket_name):
-        """upload index.html, style.css, gallery.js and noThumbnail.jpg"""
-        for item in frontend_files:
-            item_path = os.path.join(sys.path[0], item["name"])
-            #print(item_path)
-            metadata = self.get_key_metadata(bucket_name, item["name"]) 
-            #if the file exists and out-of-date
-            if metadata:
-                local_copy_date = os.path.getmtime(item_path)
-                last_uploaded = metadata.get("LastModified", 0).timestamp()
-
-                if last_uploaded < local_copy_date:
-                    print('Update file: %s' % item["name"])
-                    s3.meta.client.upload_file(Filename = item_path, 
-                            Bucket = bucket_name, Key = item["name"],
-                            ExtraArgs = {'ACL': 'public-read', 'ContentType': item["type"]})
-            else: 
-                #if the file doesnt exist - need to be uploaded
-                print('Update file: %s' % item["name"])
-                s3.meta.client.upload_file(Filename = item_path, 
-                        Bucket = bucket_name, Key = item["name"],
-                        ExtraArgs = {'ACL': 'public-read', 'ContentType': item["type"]})
-
-    def create_bucket(self, bucket_name):
-        s3.create_bucket(Bucket = bucket_name,
-                ACL = "public-read",
-                CreateBucketConfiguration={ 'LocationConstraint': 'EU'})
-
-    def update_or_create_album(self, path, album_name):
-        bucket_name = self.get_bucket_name_for_album(album_name)
-        if not self.is_valid_bucket(album_name):
-            print('New album: %s \n' % album_name)
-            #create bucket
-            try:
-                self.create_bucket(bucket_name)
-                clear_hash_data(path)
-            except botocore.client.ClientError as e:
-                print('Invalid album name: %s \n Use only lowercase letters and numbers. \n' % album_name)
-                exit()
-        self.update_frontend_files(bucket_name)
-        self.update_bucket(path, album_name)
-
-    def upload_all(self, path, album):
-        """Upload all media files from the given folder to the given album"""
-        album_name = get_album_name(path, album)
-        self.update_or_create_album(path, album_name)
-
-    def get_json_content(self, path, album_name):
-        result = []
-        if not self.is_json_exists(album_name):
-            return result
-        else:
-            #if json file exists
-            bucket_name = self.get_bucket_name_for_album(album_name)
-            json_object = s3.Object(bucket_name, json_file)
-            file_content = json_object.get()['Body'].read().decode('utf-8')
-            return json.loads(file_content)
-
-    def is_record_has_thumbnail(self, album_name, data):
-        if not data.get('thumbnail'):
-            return False
-        return self.is_key_exists(album_name, data.get('thumbnail'))
-
-    def update_with_thumbnails(self, path, album):
-        #it there is no json file
-        album_name = get_album_name(path, album)
-        amazon_bucket_name = self.get_bucket_name_for_album(album_name)
-        json_content = self.get_json_content(path, album_name)
-        updated_records = []
-
-        if not json_content:
-            return
-
-        for data in json_content:
-            #upload thumbnails and collect data
-            if not self.is_record_has_thumbnail(album_name, data):
-                file_name = data.get('src')
-                file_path = os.path.join(path, file_name)
-                data['thumbnail'] = get_thumbnail_name(file_name)
-                #check if the original photo is available
-                if is_valid_path(file_path):
-                    #upload thumbnail
-                    if self.upload_photo_thumbnail(file_path, file_name, data['thumbnail'], amazon_bucket_name):
-                        print("Upload thumbnail: %s" % data.get('thumbnail'))
-                        updated_records.append(data)
-
-        #refresh json with updated data from records which hadn't got thumbnail
-        self.append_to_amazon_config(album_name, updated_records)
-
-    def update_view(self, path, album):
-        album_name = get_album_name(path, album)
-        if self.is_valid_bucket(album_name):
-            bucket_name = self.get_bucket_name_for_album(album_name)
-            self.update_frontend_files(bucket_name)
-        else:
+""" 
+This script is for uploading photoes and videos from the given _folder_ into amazon cloud.
+The upload method is the following:
+Step1. Selecting all the files from the _folder_ which will be uploaded (not uploaded yet)
+Step2. Create a new album if hasn't existed yet
+Step3. Update the album by file by file:
+Step3a. Upload the file
+Step3b. Upload thumbnail
+Step3c. Write photo data into the amazon config file (sharded manifest, see shardedManifest.py)
+Step 3d. Write photo data (hash code) into the local state (database in the _folder_)
+Every finished step of a file is recorded in the local state at once, so an
+interrupted run is continued by the next one from the missing steps.
+A file whose content has already been uploaded (to any album) is not uploaded
+again: its objects are copied in the cloud, or reused within the same album.
+"""
+from fileInfo import *
+from thumbnails import *
+from localState import get_state, get_object_cache, get_content_index
+from bucketInventory import BucketInventory
+from shardedManifest import ShardedManifest
+from transfers import Transfer, create_client
+from folderWatcher import FolderWatcher
+from runStats import stats, measure
+import shardedManifest
+import botocore.exceptions
+import os, sys, hashlib, time
+import gzip
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+base_bucket_name = "photos.pataky."
+json_file = shardedManifest.legacy_file
+hash_chunk_size = 1024 * 1024 #files are hashed in chunks of this size
+copy_object_limit = 5 * 1024 * 1024 * 1024 #bigger objects are copied in parts
+manifest_flush_files = 50 #flush the amazon config after this many uploaded files
+manifest_flush_seconds = 30 #...or after this many seconds
+watch_flush_seconds = 3 #in watch mode the new files are shown in the gallery this often
+watch_interval = 1 #seconds between two checks of the watched folder
+watch_retry_seconds = 5 #in watch mode the failed files are tried again this often
+manifest_cache_control = "no-cache" #cached, but revalidated by ETag - the root index and the pages must stay consistent
+#index.html is revalidated every time, it refers to the css and js with their version,
+#so those can be cached for long
+long_cache_control = "public, max-age=31536000, immutable"
+frontend_folder = os.path.dirname(os.path.abspath(__file__)) #the frontend files are next to this script
+frontend_files = [{"name": "index.html", "type": "text/html", "compress": True, "cache": "no-cache"}, 
+                {"name": "style.css", "type": "text/css", "compress": True, "cache": long_cache_control, "versioned": True}, 
+                {"name": "gallery.js", "type": "text/javascript", "compress": True, "cache": long_cache_control, "versioned": True},
+                {"name": "noThumbnail.jpg", "type": "image/jpeg", "cache": "public, max-age=86400"},
+                {"name": "000video_bcgrd_0002.png", "type": "image/png", "cache": "public, max-age=86400"}]
+
+def compress(content):
+    """gzip with a fixed timestamp, so the same content gives the same bytes (and ETag)"""
+    return gzip.compress(content, mtime = 0)
+
+def get_etag(content):
+    """ETag of an object uploaded in one part"""
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+def read_frontend_files(folder):
+    """Returns the content of the frontend files as they are uploaded.
+        index.html refers to the versioned files with their content hash
+        (style.css?v=...), so a changed file is never read from the browser cache."""
+    contents = {}
+    for item in frontend_files:
+        with open(os.path.join(folder, item["name"]), 'rb') as f:
+            contents[item["name"]] = f.read()
+    for item in frontend_files:
+        if item.get("versioned"):
+            version = hashlib.sha256(contents[item["name"]]).hexdigest()[:10]
+            name = item["name"].encode('utf-8')
+            contents["index.html"] = contents["index.html"].replace(
+                    b'"' + name + b'"', b'"' + name + b'?v=' + version.encode('utf-8') + b'"')
+    for item in frontend_files:
+        if item.get("compress"):
+            contents[item["name"]] = compress(contents[item["name"]])
+    return contents
+
+def get_diff_of_lists(listA, listB):
+    return list(set(listA) - set(listB))
+
+def calculate_hash_of_file(filepath):
+    ''' Calculates the Hash code of the file.'''
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as afile:
+        for buffer in iter(lambda: afile.read(hash_chunk_size), b''):
+            hasher.update(buffer)
+    return (hasher.hexdigest())
+
+def get_file_fingerprint(file_path):
+    """Returns the (size, mtime, inode) of the file, which changes if the content changes"""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+def get_cached_hash(path, file_name):
+    """Returns the hash of the file from the local state if the file hasn't changed since"""
+    fingerprint = get_file_fingerprint(os.path.join(path, file_name))
+    return get_state(path).get_cached_hash(file_name, *fingerprint)
+
+def get_photo_data(path, file_name, file_hash = None, media = None):
+    """Sets photo data for the given file.
+        The hash is calculated and the file is probed only if they aren't given."""
+    file_path = os.path.join(path, file_name)
+    upload_data = {'src': file_name,
+            'type': 'vid' if is_video_file(file_name) else 'img',
+            'thumbnail': get_thumbnail_name(file_name),
+            }
+    data = {'upload_data': upload_data,
+            'filename': file_name,
+            'source': file_path,
+            'dirname': path,
+            'hash': file_hash if file_hash else calculate_hash_of_file(file_path)}
+    data['size'], data['mtime_ns'], data['inode'] = get_file_fingerprint(file_path)
+    file_info = get_file_info(file_path, file_name, media)
+    data['upload_data'].update(file_info)
+    return data
+
+def clear_hash_data(path):
+    get_state(path).clear()
+
+def read_hash_from_config(path):
+    """Reads the (filename, hash_code) pairs of the uploaded files from the local state"""
+    return get_state(path).get_uploaded_hashes()
+
+def read_album_from_config(path):
+    """Reads amazon albumname for the given path from the local state
+        If there is no albumname, it returns empty string"""
+    return get_state(path).get_album()
+
+def get_album_name(path, album):
+    """ Returns the album_name. The rules:
+        First check the local state. If the album is set-it will use it.
+        If not, use the given album parameter """
+    album_name = read_album_from_config(path)
+    return album_name if album_name else album
+
+def get_uploaded_file_names(path):
+    return [file_name.lower() for file_name in get_state(path).get_uploaded_file_names()]
+
+def get_changed_files(path, file_names):
+    """Returns the uploaded files whose content has changed since the upload.
+        Only the files with a changed fingerprint are read, and their new hash
+        is recorded, so they don't count as uploaded any more."""
+    state = get_state(path)
+    changed = []
+    for file_name in file_names:
+        file_path = os.path.join(path, file_name)
+        fingerprint = get_file_fingerprint(file_path)
+        record = state.get_file(file_name)
+        if record is None or state.get_cached_hash(file_name, *fingerprint):
+            continue
+        file_hash = calculate_hash_of_file(file_path)
+        if file_hash != record['sha256']:
+            changed.append(file_name)
+        state.set_file(file_name, *fingerprint, file_hash)
+    return changed
+
+def get_uploadable_files(path, is_valid_album, detect_changes = False):
+    all_files = get_media_files(path)
+    uploaded = []
+    if is_valid_album:
+        uploaded = get_uploaded_file_names(path)
+    else:
+        clear_hash_data(path)
+    result = get_diff_of_lists(all_files, uploaded)
+    if detect_changes:
+        result += get_changed_files(path, get_diff_of_lists(all_files, result))
+    return result
+
+def get_finished_stages(path, file_name):
+    """Returns the objects of the file uploaded by an earlier (interrupted) run"""
+    fingerprint = get_file_fingerprint(os.path.join(path, file_name))
+    return get_state(path).get_finished_stages(file_name, *fingerprint)
+
+def rename_record(record, file_name):
+    """Returns the copy of a manifest record for a file with the given name,
+        and the (old key, new key) pairs of its objects"""
+    old_base = os.path.splitext(record['src'])[0]
+    new_base = os.path.splitext(file_name.lower())[0]
+    result = dict(record, src = file_name, thumbnail = get_thumbnail_name(file_name))
+    keys = [(record['src'], result['src']), (record['thumbnail'], result['thumbnail'])]
+    if 'proxy' in record:
+        proxy = dict(record['proxy'], src = get_proxy_name(file_name))
+        keys.append((record['proxy']['src'], proxy['src']))
+        if 'poster' in proxy:
+            proxy['poster'] = get_poster_name(file_name)
+            keys.append((record['proxy']['poster'], proxy['poster']))
+        result['proxy'] = proxy
+    renditions = []
+    for rendition in record.get('renditions', []):
+        rendition = dict(rendition)
+        for field in ('src', 'webp'):
+            if field in rendition:
+                #r320_<name>.jpg
+                name, ext = os.path.splitext(rendition[field])
+                new_key = name[:len(name) - len(old_base)] + new_base + ext
+                keys.append((rendition[field], new_key))
+                rendition[field] = new_key
+        renditions.append(rendition)
+    if renditions:
+        result['renditions'] = renditions
+    return result, keys
+
+def get_duplicate_data(path, file_name, file_hash, bucket_name, duplicate):
+    """Photo data of a file whose content has already been uploaded: the metadata
+        comes from the record of the uploaded one. Within the same album its
+        objects are reused, otherwise they are copied under the new names."""
+    source_bucket, record = duplicate
+    record.pop('sprite', None)
+    if source_bucket == bucket_name:
+        keys = [(key, key) for key in get_record_keys(record)]
+    else:
+        record, keys = rename_record(record, file_name)
+    file_path = os.path.join(path, file_name)
+    data = {'upload_data': record,
+            'filename': file_name,
+            'source': file_path,
+            'dirname': path,
+            'hash': file_hash,
+            'duplicate_of': {'bucket': source_bucket, 'keys': keys}}
+    data['size'], data['mtime_ns'], data['inode'] = get_file_fingerprint(file_path)
+    return data
+
+def get_record_keys(record):
+    """Returns the keys of the objects of a manifest record"""
+    keys = [record['src'], record['thumbnail']]
+    if 'proxy' in record:
+        keys.extend(record['proxy'][field] for field in ('src', 'poster') if field in record['proxy'])
+    for rendition in record.get('renditions', []):
+        keys.extend(rendition[field] for field in ('src', 'webp') if field in rendition)
+    return keys
+
+def is_thumbnail_stale(record, keys, spec):
+    """Tells if the thumbnail of a manifest record has to be made again: it is
+        missing from the bucket keys or it was made by another spec.
+        The bucket isn't asked object by object."""
+    if not record.get('thumbnail') or record['thumbnail'] not in keys:
+        return True
+    return record.get('thumb_spec') != spec
+
+def make_thumbnail_data(file_path, file_name, video_position = None, quality = None, original_hash = None,
+        file_hash = None):
+    """Makes the thumbnail of a file again. It runs in a worker process.
+        Returns the thumbnail, its placeholder, the hash and size of the
+        original and the stage timings, or None if there is no thumbnail.
+        The file is hashed only if its hash isn't given. If the content of
+        the file isn't the given original, nothing is made, only the hash is
+        returned (with 'changed')."""
+    timings = {}
+    if not file_hash:
+        with measure('hash', timings):
+            file_hash = calculate_hash_of_file(file_path)
+    if original_hash and file_hash != original_hash:
+        return {'hash': file_hash, 'changed': True}
+    with measure('probe', timings):
+        media = probe_media(file_path, file_name, keep_image = True)
+    try:
+        with measure('thumbnail', timings):
+            thumbnail = generate_thubnail(file_path, file_name, media, video_position, quality)
+    finally:
+        media.close()
+    if thumbnail is None:
+        return None
+    thumbnail = thumbnail.getvalue()
+    with measure('placeholder', timings):
+        blurhash = make_placeholder(thumbnail)
+    return {'thumbnail': thumbnail, 'blurhash': blurhash, 'hash': file_hash,
+            'size': os.path.getsize(file_path), 'timings': timings}
+
+def prepare_file(path, file_name, file_hash = None, video_position = None, quality = None,
+        renditions = True, webp = False, bucket_name = None):
+    """Collects the photo data and generates the thumbnail (and the renditions)
+        of the given file. It runs in a worker process if the upload is pipelined.
+        If the bucket is given and the content of the file has already been
+        uploaded, nothing is generated, the data of the uploaded one is used.
+        Returns the photo data, the thumbnail and the list of the rendition files."""
+    file_path = os.path.join(path, file_name)
+    #the stages of the file are timed into its data, see runStats.py
+    timings = {}
+    if bucket_name and not file_hash:
+        with measure('hash', timings):
+            file_hash = calculate_hash_of_file(file_path)
+    if bucket_name:
+        duplicate = get_content_index().get(file_hash, bucket_name)
+        if duplicate:
+            file_data = get_duplicate_data(path, file_name, file_hash, bucket_name, duplicate)
+            file_data['timings'] = timings
+            return file_data, None, []
+    with measure('probe', timings):
+        media = probe_media(file_path, file_name, keep_image = True)
+    rendition_files = []
+    try:
+        if not file_hash:
+            with measure('hash', timings):
+                file_hash = calculate_hash_of_file(file_path)
+        file_data = get_photo_data(path, file_name, file_hash, media)
+        file_data['timings'] = timings
+        with measure('thumbnail', timings):
+            if renditions and has_renditions(file_name):
+                thumbnail, rendition_data, rendition_files = generate_renditions(file_path, file_name, media, quality, webp)
+                if rendition_data:
+                    file_data['upload_data']['renditions'] = rendition_data
+            else:
+                thumbnail = generate_thubnail(file_path, file_name, media, video_position, quality)
+    finally:
+        media.close()
+    if thumbnail is None:
+        return file_data, None, rendition_files
+    thumbnail = thumbnail.getvalue()
+    with measure('placeholder', timings):
+        file_data['upload_data']['blurhash'] = make_placeholder(thumbnail)
+    #a thumbnail made by an older spec or from other content is found stale by -thumbnail
+    file_data['upload_data']['thumb_spec'] = get_thumb_spec(quality)
+    file_data['upload_data']['hash'] = file_data['hash']
+    return file_data, thumbnail, rendition_files
+
+class ProgressPercentage(object):
+    """Aggregate progress of all the uploads in flight"""
+    def __init__(self, file_paths):
+        self._nr_of_files = len(file_paths)
+        self._size = sum(os.path.getsize(file_path) for file_path in file_paths)
+        self._lock = threading.Lock()
+        self._uploaded = 0
+        self._finished = 0
+        self._in_flight = 0
+        self.failed = 0
+
+    def byte_to_kB(self, source):
+        return str(round(source /1024)) + 'kB'
+
+    def start(self):
+        with self._lock:
+            self._in_flight += 1
+            self._write()
+
+    def finish(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._finished += 1
+            self._write()
+
+    def message(self, text):
+        """Prints the text in its own line, under the progress line"""
+        with self._lock:
+            sys.stdout.write("\n%s\n" % text)
+            self._write()
+
+    def fail(self, file_name):
+        with self._lock:
+            self.failed += 1
+        self.message('Upload failed: %s' % file_name)
+
+    def get_summary(self):
+        """Returns the number of files, the failed ones and the uploaded bytes"""
+        with self._lock:
+            return {'files': self._nr_of_files, 'failed': self.failed, 'bytes': self._uploaded}
+
+    def skip(self, bytes_amount):
+        """Counts a file which was uploaded by an earlier run"""
+        with self._lock:
+            self._finished += 1
+            self._uploaded += bytes_amount
+            self._write()
+
+    def __call__(self, bytes_amount):
+        with self._lock:
+            self._uploaded += bytes_amount
+            self._write()
+
+    def _write(self):
+        percentage = (self._uploaded * 100) / self._size if self._size else 100
+        sys.stdout.write("\r%s  %s/ %s (%.2f%%)" % (
+            'Uploading %d/%d (%d in flight):' % (self._finished, self._nr_of_files, self._in_flight),
+            self.byte_to_kB(self._uploaded),
+            self.byte_to_kB(self._size),
+            percentage))
+        sys.stdout.flush()
+
+class ManifestWriter():
+    """Collects the data of the uploaded files and merges them into the amazon
+        config in batches: every _flush_files files, every _flush_seconds seconds
+        and when the run ends. The files are marked uploaded in the local state only
+        after the amazon config has been saved, so an interrupted run uploads
+        the unsaved files again instead of losing them from the album."""
+    def __init__(self, uploader, path, album_name,
+            flush_files = manifest_flush_files, flush_seconds = manifest_flush_seconds):
+        self._uploader = uploader
+        self._path = path
+        self._album_name = album_name
+        self._flush_files = flush_files
+        self._flush_seconds = flush_seconds
+        self._records = {}
+        self._file_names = []
+        self._last_flush = time.monotonic()
+
+    def add(self, file_data):
+        upload_data = file_data.get('upload_data')
+        self._records[upload_data['src']] = upload_data
+        self._file_names.append(file_data['filename'])
+        if len(self._file_names) >= self._flush_files:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flushes the collected records if the last flush was _flush_seconds ago"""
+        if self._records and time.monotonic() - self._last_flush >= self._flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self._records:
+            with measure('manifest'):
+                self._uploader.append_to_amazon_config(self._album_name, list(self._records.values()))
+            get_state(self._path).set_uploaded(self._file_names, 'manifest')
+        self._records = {}
+        self._file_names = []
+        self._last_flush = time.monotonic()
+
+class AmazonUploader():
+    def __init__(self, jobs = 1, detect_changes = False, video_position = None, thumb_quality = None,
+            renditions = True, webp = False, proxies = False, client = None, transfer = None):
+        """jobs: number of files processed in parallel
+            detect_changes: upload again the files whose content has changed
+            video_position: the second of the video used for its thumbnail
+            thumb_quality: JPEG quality of the thumbnails (and renditions)
+            renditions: upload smaller renditions of the images for the gallery
+            webp: upload WebP renditions next to the JPEG ones
+            proxies: upload web-friendly MP4 proxies of the videos for the gallery
+            client: the S3 client of all the requests (the transfers too), it is
+                created on first use if not given
+            transfer: the transfer layer of the uploads (see transfers.py)"""
+        self.jobs = max(1, jobs)
+        self.detect_changes = detect_changes
+        self.video_position = video_position
+        self.thumb_quality = thumb_quality
+        self.renditions = renditions
+        self.webp = webp
+        self.proxies = proxies
+        self._inventories = {}
+        self._manifests = {}
+        self._client = client
+        #the transfers have their own client (see create_client) unless one is given
+        self._injected_client = client
+        self._transfer = transfer
+        if client is not None:
+            stats.watch_client(client)
+
+    @property
+    def client(self):
+        """The S3 client. boto3 is imported only here: it takes a while and
+            some of the runs (-h, a folder without new files) don't need it."""
+        if self._client is None:
+            import boto3
+            print('Connect to s3')
+            self._client = boto3.client('s3')
+            stats.watch_client(self._client)
+        return self._client
+
+    @property
+    def transfer(self):
+        """Transfer layer of the uploads, its concurrency limit is shared by all the jobs"""
+        if self._transfer is None:
+            concurrency = self.jobs * 4
+            client = self._injected_client or create_client(concurrency * 2)
+            self._transfer = Transfer(client, concurrency, concurrency * 2)
+        return self._transfer
+
+    def get_bucket_name_for_album(self, album_name):
+        return base_bucket_name + album_name
+
+    def is_valid_bucket(self, album_name):
+        result = True
+        bucket_name = self.get_bucket_name_for_album(album_name)
+        try:
+            self.client.head_bucket(Bucket = bucket_name)
+        except botocore.exceptions.ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == '404':
+                result = False
+        return result
+
+    def get_inventory(self, bucket_name):
+        """Returns the inventory of the bucket, it is listed once per run"""
+        if bucket_name not in self._inventories:
+            self._inventories[bucket_name] = BucketInventory(self.client, bucket_name)
+        return self._inventories[bucket_name]
+
+    def is_key_exists(self, album_name, key):
+        bucket_name = self.get_bucket_name_for_album(album_name)
+        return self.get_inventory(bucket_name).exists(key)
+
+    def get_key_metadata(self, bucket_name, key):
+        return self.get_inventory(bucket_name).get(key)
+
+    def is_json_exists(self, album_name):
+        return self.get_manifest(self.get_bucket_name_for_album(album_name)).exists()
+
+    def read_json(self, bucket_name, key):
+        """Returns the parsed content of the json object or None if it doesn't exist.
+            The object is downloaded only if it has changed since the last download."""
+        metadata = self.get_key_metadata(bucket_name, key)
+        if not metadata:
+            return None
+        cache = get_object_cache()
+        cached = cache.get(bucket_name, key)
+        if cached and cached[0] == metadata.get('ETag'):
+            return json.loads(cached[1].decode('utf-8'))
+        args = {'Bucket': bucket_name, 'Key': key}
+        if cached:
+            args['IfNoneMatch'] = cached[0]
+        try:
+            response = self.client.get_object(**args)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('304', 'NotModified'):
+                return json.loads(cached[1].decode('utf-8'))
+            raise
+        body = response['Body'].read()
+        if response.get('ContentEncoding') == 'gzip':
+            body = gzip.decompress(body)
+        cache.set(bucket_name, key, response['ETag'], body)
+        return json.loads(body.decode('utf-8'))
+
+    def write_json(self, bucket_name, key, content):
+        """Saves the content gzip compressed, the browsers decompress it by the Content-Encoding"""
+        body = json.dumps(content, ensure_ascii = False, separators = (',', ':')).encode('utf-8')
+        compressed = compress(body)
+        response = self.transfer.put_object(bucket_name, key, compressed,
+                ACL = 'public-read', ContentType = 'application/json; charset=utf-8',
+                ContentEncoding = 'gzip', CacheControl = manifest_cache_control)
+        self.get_inventory(bucket_name).add(key, len(compressed), response.get('ETag'))
+        get_object_cache().set(bucket_name, key, response.get('ETag'), body)
+
+    def get_manifest(self, bucket_name):
+        """Returns the manifest of the bucket. Its pages are read once per run.
+            An old photos.json is converted into the sharded manifest. It is
+            deleted only after the frontend which reads the new manifest is
+            uploaded, so the gallery keeps working whichever mode converts it."""
+        if bucket_name not in self._manifests:
+            manifest = ShardedManifest(lambda key: self.read_json(bucket_name, key),
+                    lambda key, content: self.write_json(bucket_name, key, content),
+                    lambda key, records: self.update_sprite_sheets(bucket_name, key, records))
+            if not manifest.exists() and self.get_inventory(bucket_name).exists(json_file):
+                print('Convert %s to sharded manifest' % json_file)
+                manifest.import_legacy(self.read_json(bucket_name, json_file))
+                manifest.save()
+                self.update_frontend_files(bucket_name)
+                self.client.delete_object(Bucket = bucket_name, Key = json_file)
+                self.get_inventory(bucket_name).remove(json_file)
+            self._manifests[bucket_name] = manifest
+        return self._manifests[bucket_name]
+
+    def get_all_uploadable_files(self, path, album_name):
+        """Retruns all uploadable files from the given path"""
+        print("Get photos and videos for uploading...")
+        is_valid_album = self.is_valid_bucket(album_name)
+        if not is_valid_album:
+            get_content_index().remove_bucket(self.get_bucket_name_for_album(album_name))
+        return get_uploadable_files(path, is_valid_album, self.detect_changes)
+
+    def append_to_amazon_config(self, album_name, photo_records):
+        """Merges the records into the manifest - only the touched pages are rewritten"""
+        manifest = self.get_manifest(self.get_bucket_name_for_album(album_name))
+        manifest.merge(photo_records)
+        manifest.save()
+
+    def append_photo_data_to_amazon_config(self, album_name, photo_data):
+        self.append_to_amazon_config(album_name, [photo_data.get('upload_data')])
+
+    def upload_photo(self, photo_data, bucket_name, progress = None):
+        """Uploads the original file. An interrupted multipart upload is continued
+            by the next run from the upload ID in the local state."""
+        try:
+            etag = self.transfer.upload_file(photo_data['source'], bucket_name, photo_data['filename'],
+                {'ACL': 'public-read'}, progress, get_state(photo_data['dirname']))
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            if progress:
+                progress.message('%s: %s' % (photo_data['filename'], e))
+            return False
+        self.get_inventory(bucket_name).add(photo_data['filename'], photo_data.get('size'), etag)
+        return True
+
+    def upload_photo_thumbnail(self, photo_path, photo_name, thumbnail_name, bucket_name, thumbnail = None):
+        try:
+            if thumbnail is None:
+                with measure('thumbnail'):
+                    thumbnail = generate_thubnail(photo_path, photo_name, video_position = self.video_position,
+                            quality = self.thumb_quality)
+            if thumbnail is None:
+                return False
+            content = thumbnail.getvalue()
+            response = self.transfer.put_object(bucket_name, thumbnail_name, content,
+                ACL = 'public-read', ContentType = 'image/jpeg')
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            return False
+        self.get_inventory(bucket_name).add(thumbnail_name, len(content), response.get('ETag'))
+        #the sprite sheet needs the tile, it is made now instead of downloading the thumbnail
+        get_object_cache().set_tile(bucket_name, thumbnail_name, make_sprite_tile(content))
+        return True
+
+    def upload_thumbnail(self, photo_data, bucket_name, thumbnail = None):
+        thumbnail_name = photo_data['upload_data']['thumbnail']
+        if thumbnail is not None:
+            get_object_cache().set_tile(bucket_name, thumbnail_name, make_sprite_tile(thumbnail))
+            thumbnail = BytesIO(thumbnail)
+        return self.upload_photo_thumbnail(photo_data['source'], photo_data['filename'], thumbnail_name, bucket_name, thumbnail)
+
+    def download_sprite_tile(self, bucket_name, thumbnail_name):
+        """Makes the sprite tile of a thumbnail downloaded through the transfer
+            layer and caches it. Returns None if the thumbnail can't be read."""
+        try:
+            response = self.transfer.call(self.transfer.client.get_object, Bucket = bucket_name, Key = thumbnail_name)
+            tile = make_sprite_tile(response['Body'].read())
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError, OSError) as e:
+            return None
+        get_object_cache().set_tile(bucket_name, thumbnail_name, tile)
+        return tile
+
+    def get_sprite_tiles(self, bucket_name, thumbnail_names):
+        """Returns the sprite tiles of the thumbnails (thumbnail: tile or None).
+            The thumbnails whose tile isn't cached are downloaded in parallel."""
+        cache = get_object_cache()
+        inventory = self.get_inventory(bucket_name)
+        tiles = {}
+        missing = []
+        for thumbnail_name in set(name for name in thumbnail_names if name):
+            tiles[thumbnail_name] = cache.get_tile(bucket_name, thumbnail_name)
+            if tiles[thumbnail_name] is None and inventory.exists(thumbnail_name):
+                missing.append(thumbnail_name)
+        if missing:
+            with ThreadPoolExecutor(max_workers = self.jobs * 4) as downloaders:
+                downloaded = downloaders.map(lambda name: self.download_sprite_tile(bucket_name, name), missing)
+                tiles.update(zip(missing, downloaded))
+        return tiles
+
+    def update_sprite_sheets(self, bucket_name, page_key, records):
+        """Keeps the sprite sheets of a manifest page (sprite_columns * sprite_rows
+            tiles per sheet) up to date and records the position of every tile as
+            record['sprite'] = [sheet, column, row].
+            A record keeps its slot on a sheet of the page, the records without
+            one fill the free slots, then new sheets. Only the sheets which got
+            new tiles are built again, so an insert doesn't move the other tiles.
+            A sheet is named by the hash of its tiles; the sheets of the page
+            which aren't used any more are deleted."""
+        inventory = self.get_inventory(bucket_name)
+        page_id = os.path.splitext(os.path.basename(page_key))[0]
+        sheet_prefix = "%s%s-" % (sprite_prefix, page_id)
+        per_sheet = sprite_columns * sprite_rows
+        #sheet key (or number of a new sheet): {slot: record}
+        sheets = {}
+        placing = []
+        for record in records:
+            sprite = record.pop('sprite', None)
+            if sprite and sprite[0].startswith(sheet_prefix) and inventory.exists(sprite[0]):
+                slots = sheets.setdefault(sprite[0], {})
+                slot = sprite[2] * sprite_columns + sprite[1]
+                if slot not in slots:
+                    slots[slot] = record
+                    continue
+            placing.append(record)
+        tiles = self.get_sprite_tiles(bucket_name, [record.get('thumbnail') for record in placing])
+        placing = [record for record in placing if tiles.get(record.get('thumbnail'))]
+        changed = set()
+        for key in sorted(sheets):
+            slots = sheets[key]
+            for slot in range(per_sheet):
+                if not placing:
+                    break
+                if slot not in slots:
+                    slots[slot] = placing.pop(0)
+                    changed.add(key)
+        for start in range(0, len(placing), per_sheet):
+            sheets[len(sheets)] = dict(enumerate(placing[start:start + per_sheet]))
+            changed.add(len(sheets) - 1)
+
+        used = set()
+        for key, slots in sheets.items():
+            if key in changed:
+                tiles = self.get_sprite_tiles(bucket_name, [record.get('thumbnail') for record in slots.values()])
+                sheet_tiles = [None] * per_sheet
+                for slot, record in slots.items():
+                    sheet_tiles[slot] = tiles.get(record.get('thumbnail'))
+                if not any(sheet_tiles):
+                    #a blank sheet would be used by no record
+                    continue
+                hasher = hashlib.sha256()
+                for tile in sheet_tiles:
+                    hasher.update(hashlib.sha256(tile or b'').digest())
+                key = "%s%s.jpg" % (sheet_prefix, hasher.hexdigest()[:12])
+                if not inventory.exists(key):
+                    content = build_sprite_sheet(sheet_tiles)
+                    response = self.transfer.put_object(bucket_name, key, content,
+                            ACL = 'public-read', ContentType = 'image/jpeg', CacheControl = long_cache_control)
+                    inventory.add(key, len(content), response.get('ETag'))
+                slots = {slot: record for slot, record in slots.items() if sheet_tiles[slot]}
+            used.add(key)
+            for slot, record in slots.items():
+                record['sprite'] = [key, *get_sprite_position(slot)]
+        unused = [key for key in inventory.keys() if key.startswith(sheet_prefix) and key not in used]
+        if unused:
+            self.transfer.call(self.transfer.client.delete_objects, Bucket = bucket_name,
+                    Delete = {'Objects': [{'Key': key} for key in unused]})
+            for key in unused:
+                inventory.remove(key)
+
+    def upload_content(self, bucket_name, key, content, content_type):
+        """Uploads the given bytes under the given key"""
+        try:
+            response = self.transfer.put_object(bucket_name, key, content,
+                ACL = 'public-read', ContentType = content_type)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            return False
+        self.get_inventory(bucket_name).add(key, len(content), response.get('ETag'))
+        return True
+
+    def upload_proxy(self, file_data, bucket_name):
+        """Transcodes a video into its proxy and uploads it with its poster, then
+            records the proxy in the manifest record. It runs in the upload thread
+            (ffmpeg has its own process), so the temporary proxy file is removed
+            here whatever happens. A video without a proxy is played as it is."""
+        if not self.proxies or file_data['upload_data']['type'] != 'vid':
+            return True
+        timings = file_data.setdefault('timings', {})
+        handle, proxy_file = tempfile.mkstemp(suffix = proxy_ext)
+        os.close(handle)
+        try:
+            with measure('proxy', timings):
+                proxy, poster = generate_proxy(file_data['source'], file_data['filename'], proxy_file,
+                        self.video_position, self.thumb_quality)
+            if proxy is None:
+                return True
+            with measure('upload_proxy', timings):
+                if poster and not self.upload_content(bucket_name, *poster):
+                    return False
+                try:
+                    etag = self.transfer.upload_file(proxy_file, bucket_name, proxy['src'],
+                        {'ACL': 'public-read', 'ContentType': 'video/mp4'}, state = get_state(file_data['dirname']))
+                except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                    return False
+                self.get_inventory(bucket_name).add(proxy['src'], os.path.getsize(proxy_file), etag)
+        finally:
+            os.remove(proxy_file)
+        file_data['upload_data']['proxy'] = proxy
+        get_state(file_data['dirname']).set_record(file_data['filename'], file_data['upload_data'])
+        return True
+
+    def upload_renditions(self, rendition_files, bucket_name):
+        for name, content, content_type in rendition_files:
+            if not self.upload_content(bucket_name, name, content, content_type):
+                return False
+        return True
+
+    def copy_duplicate(self, file_data, bucket_name):
+        """Copies the objects of an already uploaded content in the cloud under the
+            names of the file. The objects of the same album are only checked."""
+        duplicate = file_data['duplicate_of']
+        inventory = self.get_inventory(bucket_name)
+        try:
+            for source, target in duplicate['keys']:
+                if duplicate['bucket'] == bucket_name and source == target:
+                    if not inventory.exists(target):
+                        return False
+                    continue
+                copy_source = {'Bucket': duplicate['bucket'], 'Key': source}
+                if target == file_data['filename'] and file_data['size'] > copy_object_limit:
+                    self.transfer.call(self.transfer.client.copy, CopySource = copy_source,
+                            Bucket = bucket_name, Key = target, ExtraArgs = {'ACL': 'public-read'})
+                    inventory.add(target, file_data['size'])
+                else:
+                    response = self.transfer.call(self.transfer.client.copy_object, CopySource = copy_source,
+                            Bucket = bucket_name, Key = target, ACL = 'public-read')
+                    inventory.add(target, None, response['CopyObjectResult'].get('ETag'))
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            return False
+        return True
+
+    def prepare_duplicate_again(self, file_data):
+        """Makes the data of a file which turned out not to be a duplicate, in
+            place of its duplicate data. Returns its thumbnail and rendition files."""
+        get_content_index().remove(file_data['hash'], file_data['duplicate_of']['bucket'])
+        new_data, thumbnail, rendition_files = prepare_file(file_data['dirname'], file_data['filename'],
+                file_data['hash'], self.video_position, self.thumb_quality, self.renditions, self.webp)
+        del file_data['duplicate_of']
+        timings = file_data['timings']
+        file_data.update(new_data)
+        for stage, seconds in new_data['timings'].items():
+            timings[stage] = timings.get(stage, 0) + seconds
+        file_data['timings'] = timings
+        self.journal_file_data(file_data['dirname'], file_data)
+        return thumbnail, rendition_files
+
+    def upload_file_data(self, file_data, thumbnail, rendition_files, bucket_name, progress, finished = ()):
+        """Uploads the original, then the thumbnail and the renditions of one file.
+            The objects in finished were uploaded by an earlier run, they are skipped.
+            Every uploaded object is recorded in the local state at once."""
+        state = get_state(file_data['dirname'])
+        timings = file_data.setdefault('timings', {})
+        progress.start()
+        try:
+            if 'duplicate_of' in file_data and 'original' not in finished:
+                with measure('copy', timings):
+                    copied = self.copy_duplicate(file_data, bucket_name)
+                if copied:
+                    progress(file_data['size'])
+                    state.set_uploaded([file_data['filename']], 'original', 'thumbnail')
+                    get_content_index().add(file_data['hash'], bucket_name, file_data['upload_data'])
+                    return True
+                #the uploaded content is gone (it can be the file itself, after -reconcile),
+                #so the file is uploaded as a new one
+                thumbnail, rendition_files = self.prepare_duplicate_again(file_data)
+            if 'original' in finished:
+                progress(file_data['size'])
+            else:
+                with measure('upload_original', timings):
+                    uploaded = self.upload_photo(file_data, bucket_name, progress)
+                if not uploaded:
+                    return False
+                state.set_uploaded([file_data['filename']], 'original')
+            if 'thumbnail' not in finished:
+                with measure('upload_thumbnail', timings):
+                    uploaded = self.upload_thumbnail(file_data, bucket_name, thumbnail) \
+                            and self.upload_renditions(rendition_files, bucket_name)
+                if not uploaded or not self.upload_proxy(file_data, bucket_name):
+                    return False
+                state.set_uploaded([file_data['filename']], 'thumbnail')
+            get_content_index().add(file_data['hash'], bucket_name, file_data['upload_data'])
+            return True
+        finally:
+            progress.finish()
+
+    def journal_file_data(self, path, file_data):
+        """Records the prepared file with its hash and manifest record"""
+        state = get_state(path)
+        state.set_file(file_data['filename'], file_data['size'], file_data['mtime_ns'], file_data['inode'], file_data['hash'])
+        state.set_record(file_data['filename'], file_data['upload_data'])
+
+    def replay_file(self, path, manifest, file_name, finished, progress):
+        """Queues the saved record of a file whose objects were all uploaded by
+            an earlier run. Returns False if the file has to be prepared."""
+        if 'original' not in finished or 'thumbnail' not in finished:
+            return False
+        record = get_state(path).get_record(file_name)
+        if record is None:
+            return False
+        size = os.path.getsize(os.path.join(path, file_name))
+        progress.skip(size)
+        stats.add_file(file_name, size, {}, 'replayed')
+        manifest.add({'filename': file_name, 'upload_data': record})
+        return True
+
+    def commit_file_data(self, path, manifest, file_data, uploaded, progress):
+        """Queues the data of the uploaded file for the amazon config"""
+        result = 'failed'
+        if uploaded:
+            result = 'duplicate' if 'duplicate_of' in file_data else 'uploaded'
+        stats.add_file(file_data['filename'], file_data.get('size'), file_data.get('timings', {}), result)
+        if uploaded:
+            manifest.add(file_data)
+        else:
+            progress.fail(file_data['filename'])
+
+    def fail_prepare(self, path, manifest, file_name, error, progress):
+        """Counts a file which couldn't be prepared (unreadable, corrupt) as failed, the others go on"""
+        progress.message('%s: %s' % (file_name, error))
+        self.commit_file_data(path, manifest, {'filename': file_name}, False, progress)
+
+    def upload_files(self, path, manifest, file_names, bucket_name, progress):
+        """Uploads the files one by one"""
+        for file_name in file_names:
+            finished = get_finished_stages(path, file_name)
+            if self.replay_file(path, manifest, file_name, finished, progress):
+                continue
+            try:
+                file_data, thumbnail, rendition_files = prepare_file(path, file_name, get_cached_hash(path, file_name),
+                        self.video_position, self.thumb_quality, self.renditions, self.webp, bucket_name)
+            except Exception as e:
+                self.fail_prepare(path, manifest, file_name, e, progress)
+                continue
+            self.journal_file_data(path, file_data)
+            uploaded = self.upload_file_data(file_data, thumbnail, rendition_files, bucket_name, progress, finished)
+            self.commit_file_data(path, manifest, file_data, uploaded, progress)
+
+    def upload_files_pipelined(self, path, manifest, file_names, bucket_name, progress):
+        """Uploads the files in a pipeline: photo data and thumbnails are prepared
+            in a process pool, the uploads run in a thread pool. The amazon config
+            is written only from this thread, the upload threads record the
+            uploaded objects in the local state."""
+        remaining = iter(file_names)
+        #bounds the number of files (and thumbnails) held in memory
+        window = self.jobs * 4
+        preparing = {}
+        uploading = {}
+        with ProcessPoolExecutor(max_workers = self.jobs) as preparers, \
+                ThreadPoolExecutor(max_workers = self.jobs) as uploaders:
+            while True:
+                while len(preparing) + len(uploading) < window:
+                    file_name = next(remaining, None)
+                    if file_name is None:
+                        break
+                    finished = get_finished_stages(path, file_name)
+                    if self.replay_file(path, manifest, file_name, finished, progress):
+                        continue
+                    file_hash = get_cached_hash(path, file_name)
+                    preparing[preparers.submit(prepare_file, path, file_name, file_hash,
+                            self.video_position, self.thumb_quality, self.renditions, self.webp,
+                            bucket_name)] = file_name, finished
+                if not preparing and not uploading:
+                    break
+                done, _ = wait(list(preparing) + list(uploading), return_when = FIRST_COMPLETED)
+                for future in done:
+                    if future in preparing:
+                        file_name, finished = preparing.pop(future)
+                        try:
+                            file_data, thumbnail, rendition_files = future.result()
+                        except Exception as e:
+                            self.fail_prepare(path, manifest, file_name, e, progress)
+                            continue
+                        self.journal_file_data(path, file_data)
+                        upload = uploaders.submit(self.upload_file_data, file_data, thumbnail, rendition_files,
+                                bucket_name, progress, finished)
+                        uploading[upload] = file_data
+                    else:
+                        file_data = uploading.pop(future)
+                        self.commit_file_data(path, manifest, file_data, future.result(), progress)
+
+    def update_bucket(self, path, album_name):
+        """Uploads the new files of the folder.
+            Returns the summary of the run (files, failed, bytes)."""
+        print('Update album: %s \n' % album_name)
+
+        file_names = self.get_all_uploadable_files(path, album_name)
+        print('New files: %d \n' % (len(file_names)))
+        resumed = [file_name for file_name in file_names if get_finished_stages(path, file_name)]
+        if resumed:
+            print('Continue the interrupted upload of %d files \n' % len(resumed))
+
+        #update bucket
+        amazon_bucket_name = self.get_bucket_name_for_album(album_name)
+        if not file_names:
+            return {'files': 0, 'failed': 0, 'bytes': 0}
+        #checks if the album name is in the local state. If not, put it in
+        get_state(path).set_album(album_name)
+        manifest = ManifestWriter(self, path, album_name)
+        try:
+            progress = self.upload_file_names(path, manifest, file_names, amazon_bucket_name)
+        finally:
+            #save what has been uploaded, even if the run was interrupted
+            manifest.flush()
+        print('\n')
+        return progress.get_summary()
+
+    def upload_file_names(self, path, manifest, file_names, bucket_name):
+        """Uploads the given files of the folder, returns their progress"""
+        progress = ProgressPercentage([os.path.join(path, file_name) for file_name in file_names])
+        if self.jobs > 1:
+            self.upload_files_pipelined(path, manifest, file_names, bucket_name, progress)
+        else:
+            self.upload_files(path, manifest, file_names, bucket_name, progress)
+        return progress
+
+    def watch(self, path, album, settle = 2.0):
+        """Uploads the files of the folder, then keeps watching it and uploads
+            every new file as soon as it has been written completely (unchanged
+            for `settle` seconds). The records are merged into the manifest every
+            watch_flush_seconds, the failed files are tried again every
+            watch_retry_seconds. It runs until it is interrupted (Ctrl+C)."""
+        album_name = get_album_name(path, album)
+        self.update_or_create_album(path, album_name)
+        bucket_name = self.get_bucket_name_for_album(album_name)
+        watcher = FolderWatcher(path, settle)
+        print('Watch folder: %s (%s)' % (path, 'inotify' if watcher.uses_inotify() else 'polling'))
+        manifest = ManifestWriter(self, path, album_name, flush_seconds = watch_flush_seconds)
+        #the watcher reports a file only once, the failed ones are kept here
+        failed = set()
+        last_retry = time.monotonic()
+        try:
+            while True:
+                settled = watcher.wait(watch_interval)
+                if failed and time.monotonic() - last_retry >= watch_retry_seconds:
+                    settled = list(set(settled) | set(file_name for file_name in failed
+                            if is_valid_path(os.path.join(path, file_name))))
+                    failed = set()
+                    last_retry = time.monotonic()
+                if settled:
+                    file_names = get_diff_of_lists(settled, get_uploaded_file_names(path))
+                    if self.detect_changes:
+                        file_names += get_changed_files(path, get_diff_of_lists(settled, file_names))
+                    if file_names:
+                        print('\nNew files: %d' % len(file_names))
+                        progress = self.upload_file_names(path, manifest, file_names, bucket_name)
+                        if progress.failed:
+                            failed |= set(get_diff_of_lists(file_names, get_uploaded_file_names(path)))
+                            last_retry = time.monotonic()
+                manifest.flush_if_due()
+        except KeyboardInterrupt as e:
+            print('\nStop watching')
+        finally:
+            watcher.stop()
+            manifest.flush()
+
+    def upload_frontend_file(self, bucket_name, item, content):
+        print('Update file: %s' % item["name"])
+        extra_args = {'ACL': 'public-read', 'ContentType': item["type"], 'CacheControl': item["cache"]}
+        if item.get("compress"):
+            extra_args['ContentEncoding'] = 'gzip'
+        response = self.transfer.put_object(bucket_name, item["name"], content, **extra_args)
+        self.get_inventory(bucket_name).add(item["name"], len(content), response.get('ETag'))
+
+    def update_frontend_files(self, bucket_name):
+        """upload index.html, style.css, gallery.js and noThumbnail.jpg
+            A file is uploaded if it doesn't exist or its ETag (MD5 of the
+            uploaded content) differs from the local one."""
+        contents = read_frontend_files(frontend_folder)
+        with measure('frontend'):
+            for item in frontend_files:
+                content = contents[item["name"]]
+                metadata = self.get_key_metadata(bucket_name, item["name"]) 
+                #if the file doesnt exist or out-of-date - need to be uploaded
+                if not metadata or metadata.get('ETag') != get_etag(content):
+                    self.upload_frontend_file(bucket_name, item, content)
+
+    def create_bucket(self, bucket_name):
+        self.client.create_bucket(Bucket = bucket_name,
+                ACL = "public-read",
+                CreateBucketConfiguration={ 'LocationConstraint': 'EU'})
+
+    def update_or_create_album(self, path, album_name):
+        bucket_name = self.get_bucket_name_for_album(album_name)
+        if not self.is_valid_bucket(album_name):
+            print('New album: %s \n' % album_name)
+            #create bucket
+            try:
+                self.create_bucket(bucket_name)
+                clear_hash_data(path)
+            except botocore.exceptions.ClientError as e:
+                print('Invalid album name: %s \n Use only lowercase letters and numbers. \n' % album_name)
+                exit()
+        self.update_frontend_files(bucket_name)
+        return self.update_bucket(path, album_name)
+
+    def upload_all(self, path, album):
+        """Upload all media files from the given folder to the given album"""
+        album_name = get_album_name(path, album)
+        return self.update_or_create_album(path, album_name)
+
+    def get_json_content(self, path, album_name):
+        """Returns all the records of the manifest"""
+        return self.get_manifest(self.get_bucket_name_for_album(album_name)).records()
+
+    def download_original(self, bucket_name, key):
+        """Streams the original from the bucket into a temporary file.
+            Returns the path of the file or None if it couldn't be downloaded."""
+        handle, file_path = tempfile.mkstemp(suffix = os.path.splitext(key)[1])
+        try:
+            with os.fdopen(handle, 'wb') as f, measure('download'):
+                response = self.transfer.call(self.client.get_object, Bucket = bucket_name, Key = key)
+                shutil.copyfileobj(response['Body'], f, hash_chunk_size)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+            print('%s: %s' % (key, e))
+            os.remove(file_path)
+            return None
+        return file_path
+
+    def upload_regenerated_thumbnail(self, bucket_name, record, thumbnail_data, spec):
+        """Uploads the thumbnail made again and updates the manifest record"""
+        thumbnail_name = get_thumbnail_name(record['src'])
+        with measure('upload_thumbnail', thumbnail_data['timings']):
+            if not self.upload_content(bucket_name, thumbnail_name, thumbnail_data['thumbnail'], 'image/jpeg'):
+                return False
+        record.update(thumbnail = thumbnail_name, blurhash = thumbnail_data['blurhash'],
+                thumb_spec = spec, hash = thumbnail_data['hash'])
+        #the new tile goes into a free slot, so its sheet is built again
+        record.pop('sprite', None)
+        return True
+
+    def update_with_thumbnails(self, path, album):
+        """Makes the missing and stale thumbnails of the album again (see
+            is_thumbnail_stale), found from the manifest and one listing of the bucket.
+            The thumbnails are made in worker processes from the local originals,
+            or from the originals streamed from the bucket if the local ones are
+            gone or their content differs from the uploaded one (by the hash in
+            the record or in the local state). The manifest is saved once at the end."""
+        album_name = get_album_name(path, album)
+        bucket_name = self.get_bucket_name_for_album(album_name)
+        records = self.get_json_content(path, album_name)
+        if not records:
+            return
+        keys = self.get_inventory(bucket_name).keys()
+        spec = get_thumb_spec(self.thumb_quality)
+        stale = [record for record in records if is_thumbnail_stale(record, keys, spec)]
+        print('Stale thumbnails: %d of %d' % (len(stale), len(records)))
+        uploaded_hashes = read_hash_from_config(path)
+        get_original_hash = lambda record: record.get('hash') or uploaded_hashes.get(record['src'])
+
+        def download(record):
+            if record['src'] in keys:
+                downloading[transfers.submit(self.download_original, bucket_name, record['src'])] = record
+            else:
+                print('No original for thumbnail: %s' % record['src'])
+
+        remaining = iter(stale)
+        updated_records = []
+        #downloading: record, making: (record, temporary file), uploading: (record, thumbnail data)
+        downloading, making, uploading = {}, {}, {}
+        window = self.jobs * 2
+        with ProcessPoolExecutor(max_workers = self.jobs) as makers, \
+                ThreadPoolExecutor(max_workers = self.jobs) as transfers:
+            while True:
+                while len(downloading) + len(making) < window:
+                    record = next(remaining, None)
+                    if record is None:
+                        break
+                    file_path = os.path.join(path, record['src'])
+                    original_hash = get_original_hash(record)
+                    #a local file known to have other content is not even hashed, an unchanged one isn't read again
+                    cached_hash = get_cached_hash(path, record['src']) if is_valid_path(file_path) else None
+                    if is_valid_path(file_path) and cached_hash in (None, original_hash):
+                        making[makers.submit(make_thumbnail_data, file_path, record['src'],
+                                self.video_position, self.thumb_quality, original_hash, cached_hash)] = record, None
+                    else:
+                        download(record)
+                if not downloading and not making and not uploading:
+                    break
+                done, _ = wait(list(downloading) + list(making) + list(uploading), return_when = FIRST_COMPLETED)
+                for future in done:
+                    if future in downloading:
+                        record = downloading.pop(future)
+                        temp_path = future.result()
+                        if temp_path:
+                            making[makers.submit(make_thumbnail_data, temp_path, record['src'],
+                                    self.video_position, self.thumb_quality)] = record, temp_path
+                    elif future in making:
+                        record, temp_path = making.pop(future)
+                        try:
+                            thumbnail_data = future.result()
+                        finally:
+                            if temp_path:
+                                os.remove(temp_path)
+                        if thumbnail_data is None:
+                            stats.add_file(record['src'], None, {}, 'failed')
+                            continue
+                        if thumbnail_data.get('changed'):
+                            #the local file isn't the uploaded original
+                            download(record)
+                            continue
+                        uploading[transfers.submit(self.upload_regenerated_thumbnail, bucket_name, record,
+                                thumbnail_data, spec)] = record, thumbnail_data
+                    else:
+                        record, thumbnail_data = uploading.pop(future)
+                        uploaded = future.result()
+                        stats.add_file(record['src'], thumbnail_data['size'], thumbnail_data['timings'],
+                                'regenerated' if uploaded else 'failed')
+                        if uploaded:
+                            #the sprite tile of the old thumbnail is replaced
+                            get_object_cache().set_tile(bucket_name, record['thumbnail'],
+                                    make_sprite_tile(thumbnail_data['thumbnail']))
+                            updated_records.append(record)
+                            print("Upload thumbnail: %s" % record['thumbnail'])
+
+        #the manifest (and the sprite sheets of its touched pages) is saved once
+        self.append_to_amazon_config(album_name, updated_records)
+
+    def reconcile(self, path, album):
+        """Checks the local state against the bucket: the files whose original,
+            thumbnail or manifest record is missing from the bucket don't count
+            as uploaded any more, so the next upload sends them again.
+            The keys come from the journaled record of the file: a duplicate
+            within the album uses the objects and record of the uploaded one."""
+        album_name = get_album_name(path, album)
+        if not self.is_valid_bucket(album_name):
+            print('Invalid album.')
+            return
+        bucket_name = self.get_bucket_name_for_album(album_name)
+        inventory = self.get_inventory(bucket_name)
+        keys = inventory.keys()
+        in_manifest = set(data.get('src') for data in self.get_json_content(path, album_name))
+        state = get_state(path)
+        missing = {'original': [], 'thumbnail': [], 'manifest': []}
+        for file_name in state.get_uploaded_file_names():
+            record = state.get_record(file_name) or {}
+            src = record.get('src', file_name)
+            if src not in keys:
+                missing['original'].append(file_name)
+            if record.get('thumbnail', get_thumbnail_name(file_name)) not in keys:
+                missing['thumbnail'].append(file_name)
+            if src not in in_manifest:
+                missing['manifest'].append(file_name)
+        for stage, file_names in missing.items():
+            state.set_not_uploaded(file_names, stage)
+            print('Missing from the bucket (%s): %d' % (stage, len(file_names)))
+
+    def update_view(self, path, album):
+        album_name = get_album_name(path, album)
+        if self.is_valid_bucket(album_name):
+            bucket_name = self.get_bucket_name_for_album(album_name)
+            self.update_frontend_files(bucket_name)
+        else:
             print('Invalid album.')
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""
+Batch mode: uploads every album folder under a root folder.
+A folder with media files is an album, its name comes from the local state
+of the folder or from the folder name (see get_album_name). The albums are
+uploaded in parallel worker processes, which share one budget of S3 requests
+in flight. The run ends with one summary of all the albums.
+"""
+from amazonUploader import AmazonUploader, get_album_name
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fileInfo import get_media_files
+from runStats import stats
+import multiprocessing
+import os
+import time
+import transfers
+
+def find_album_folders(root):
+    """Returns the folders under root (root included) which have media files"""
+    folders = []
+    for folder, subfolders, file_names in os.walk(root):
+        #hidden folders (.git, .thumbnails...) are skipped
+        subfolders[:] = sorted(name for name in subfolders if not name.startswith('.'))
+        if get_media_files(folder):
+            folders.append(folder)
+    return folders
+
+def upload_album(folder, uploader_args, show_stats = False):
+    """Uploads one album folder in a worker process, returns its summary"""
+    start = time.monotonic()
+    #a worker process uploads more albums one after the other
+    stats.reset()
+    album_name = get_album_name(folder, os.path.basename(os.path.abspath(folder)))
+    summary = {'album': album_name, 'folder': folder, 'files': 0, 'failed': 0, 'bytes': 0, 'error': None}
+    try:
+        summary.update(AmazonUploader(**uploader_args).upload_all(folder, album_name) or {})
+    except (Exception, SystemExit) as e:
+        summary['error'] = str(e) or type(e).__name__
+    summary['seconds'] = time.monotonic() - start
+    if show_stats:
+        print('\nStats of %s:' % folder)
+        stats.print_summary()
+    return summary
+
+def print_summary(summaries, seconds):
+    print('\n%-30s %8s %8s %10s %8s' % ('Album', 'Files', 'Failed', 'MB', 'Seconds'))
+    for summary in summaries:
+        print('%-30s %8d %8d %10.1f %8.0f%s' % (summary['album'], summary['files'], summary['failed'],
+                summary['bytes'] / 1024 / 1024, summary['seconds'],
+                '  error: %s' % summary['error'] if summary['error'] else ''))
+    print('%-30s %8d %8d %10.1f %8.0f' % ('Total (%d albums)' % len(summaries),
+            sum(summary['files'] for summary in summaries),
+            sum(summary['failed'] for summary in summaries),
+            sum(summary['bytes'] for summary in summaries) / 1024 / 1024, seconds))
+
+def run_batch(root, albums = 2, budget = 16, show_stats = False, **uploader_args):
+    """Uploads the album folders under root, `albums` of them at the same time,
+        with at most `budget` S3 requests in flight altogether.
+        show_stats: every worker prints the stats of its album
+        uploader_args are passed to every AmazonUploader."""
+    start = time.monotonic()
+    folders = find_album_folders(root)
+    print('Albums: %d \n' % len(folders))
+    slots = multiprocessing.BoundedSemaphore(max(1, budget))
+    summaries = []
+    with ProcessPoolExecutor(max_workers = max(1, albums), initializer = transfers.set_global_slots,
+            initargs = (slots,)) as executor:
+        futures = [executor.submit(upload_album, folder, uploader_args, show_stats) for folder in folders]
+        for future in as_completed(futures):
+            summaries.append(future.result())
+    summaries.sort(key = lambda summary: summary['folder'])
+    print_summary(summaries, time.monotonic() - start)
+    return summaries
@@ -0,0 +1,161 @@
+"""
+In-process stand-in of the S3 client for the benchmarks.
+It keeps the objects in memory and implements the calls the uploader makes,
+with the same arguments, responses and errors as the boto3 client. Every
+request is counted by operation, and an optional latency per request
+emulates the network.
+"""
+from io import BytesIO
+import botocore.exceptions
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+def client_error(code, operation, status = 400, message = ""):
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': message},
+            'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+class Paginator():
+    def __init__(self, method):
+        self._method = method
+
+    def paginate(self, **kwargs):
+        yield self._method(**kwargs)
+
+class S3Stub():
+    def __init__(self, latency = 0):
+        """latency: seconds added to every request"""
+        self.latency = latency
+        self.buckets = {}
+        self.requests = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def _request(self, operation):
+        with self._lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get_bucket(self, bucket_name, operation):
+        if bucket_name not in self.buckets:
+            raise client_error('NoSuchBucket', operation, 404)
+        return self.buckets[bucket_name]
+
+    def _get_object(self, bucket_name, key, operation):
+        bucket = self._get_bucket(bucket_name, operation)
+        if key not in bucket:
+            raise client_error('NoSuchKey', operation, 404)
+        return bucket[key]
+
+    def _put(self, bucket_name, key, body, operation, etag = None, **kwargs):
+        bucket = self._get_bucket(bucket_name, operation)
+        etag = etag or '"%s"' % hashlib.md5(body).hexdigest()
+        with self._lock:
+            bucket[key] = {'Body': body, 'ETag': etag, 'LastModified': datetime.now(timezone.utc),
+                    'ContentEncoding': kwargs.get('ContentEncoding'), 'ContentType': kwargs.get('ContentType')}
+        return {'ETag': etag}
+
+    def get_paginator(self, operation_name):
+        return Paginator(getattr(self, operation_name))
+
+    def head_bucket(self, Bucket):
+        self._request('HeadBucket')
+        if Bucket not in self.buckets:
+            raise client_error('404', 'HeadBucket', 404)
+        return {}
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._request('CreateBucket')
+        self.buckets.setdefault(Bucket, {})
+        return {}
+
+    def list_objects_v2(self, Bucket, **kwargs):
+        self._request('ListObjectsV2')
+        bucket = self._get_bucket(Bucket, 'ListObjectsV2')
+        with self._lock:
+            contents = [{'Key': key, 'Size': len(item['Body']), 'ETag': item['ETag'],
+                    'LastModified': item['LastModified']} for key, item in sorted(bucket.items())]
+        return {'Contents': contents, 'KeyCount': len(contents)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._request('PutObject')
+        return self._put(Bucket, Key, Body, 'PutObject', **kwargs)
+
+    def get_object(self, Bucket, Key, IfNoneMatch = None, **kwargs):
+        self._request('GetObject')
+        item = self._get_object(Bucket, Key, 'GetObject')
+        if IfNoneMatch and IfNoneMatch == item['ETag']:
+            raise client_error('304', 'GetObject', 304)
+        response = {'Body': BytesIO(item['Body']), 'ETag': item['ETag'], 'ContentLength': len(item['Body'])}
+        if item['ContentEncoding']:
+            response['ContentEncoding'] = item['ContentEncoding']
+        return response
+
+    def delete_object(self, Bucket, Key):
+        self._request('DeleteObject')
+        with self._lock:
+            self._get_bucket(Bucket, 'DeleteObject').pop(Key, None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        self._request('DeleteObjects')
+        bucket = self._get_bucket(Bucket, 'DeleteObjects')
+        with self._lock:
+            for item in Delete['Objects']:
+                bucket.pop(item['Key'], None)
+        return {}
+
+    def copy_object(self, CopySource, Bucket, Key, **kwargs):
+        self._request('CopyObject')
+        item = self._get_object(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        response = self._put(Bucket, Key, item['Body'], 'CopyObject', item['ETag'],
+                ContentEncoding = item['ContentEncoding'], ContentType = item['ContentType'])
+        return {'CopyObjectResult': response}
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs = None, **kwargs):
+        self.copy_object(CopySource, Bucket, Key)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._request('CreateMultipartUpload')
+        self._get_bucket(Bucket, 'CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {}
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._request('UploadPart')
+        if UploadId not in self._uploads:
+            raise client_error('NoSuchUpload', 'UploadPart', 404)
+        etag = '"%s"' % hashlib.md5(Body).hexdigest()
+        with self._lock:
+            self._uploads[UploadId][PartNumber] = (etag, Body)
+        return {'ETag': etag}
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        self._request('ListParts')
+        if UploadId not in self._uploads:
+            raise client_error('NoSuchUpload', 'ListParts', 404)
+        with self._lock:
+            parts = [{'PartNumber': number, 'ETag': etag, 'Size': len(body)}
+                    for number, (etag, body) in sorted(self._uploads[UploadId].items())]
+        return {'Parts': parts}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._request('CompleteMultipartUpload')
+        with self._lock:
+            parts = self._uploads.pop(UploadId)
+        body = b''.join(parts[part['PartNumber']][1] for part in MultipartUpload['Parts'])
+        digest = hashlib.md5(b''.join(hashlib.md5(parts[part['PartNumber']][1]).digest()
+                for part in MultipartUpload['Parts'])).hexdigest()
+        return self._put(Bucket, Key, body, 'CompleteMultipartUpload',
+                '"%s-%d"' % (digest, len(MultipartUpload['Parts'])))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._request('AbortMultipartUpload')
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
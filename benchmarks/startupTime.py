@@ -0,0 +1,56 @@
+"""
+Startup time of the command line tool.
+Every mode of main.py imports the same modules, boto3 is imported only when
+the first S3 request is made. The script imports the entry modules in fresh
+interpreters with `python -X importtime`, prints the slowest imports and
+fails (exit code 1) if an entry module is over its budget or if a module
+which must not be imported at startup has been imported.
+
+Usage: python benchmarks/startupTime.py [-runs N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#entry module: budget of its cumulative import time in milliseconds
+budgets = {"main": 200, "amazonUploader": 200, "batchUploader": 200, "folderWatcher": 100}
+#modules which mustn't be imported before they are needed
+forbidden = ("boto3", "s3transfer", "moviepy", "numpy")
+
+def measure_import(module_name):
+    """Returns the import times (module: (self ms, cumulative ms)) of a fresh import"""
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import %s' % module_name]
+    p = subprocess.run(cmd, cwd = repo_folder, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    times = {}
+    for line in p.stderr.decode('utf-8').splitlines():
+        #import time:   self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_time) / 1000, int(cumulative) / 1000)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Import time of the entry modules')
+    parser.add_argument('-runs', type = int, default = 5, help = 'The best of this many imports is taken')
+    args = parser.parse_args()
+    failed = False
+    for module_name, budget in budgets.items():
+        runs = [measure_import(module_name) for i in range(args.runs)]
+        best = min(runs, key = lambda times: times[module_name][1])
+        total = best[module_name][1]
+        status = 'ok' if total <= budget else 'OVER BUDGET'
+        print('%-16s %7.1f ms (budget %d ms) %s' % (module_name, total, budget, status))
+        slowest = sorted(best.items(), key = lambda item: item[1][0], reverse = True)[:5]
+        for name, (self_time, cumulative) in slowest:
+            print('    %-40s %7.1f ms' % (name, self_time))
+        imported = [name for name in best if name.split('.')[0] in forbidden]
+        if imported:
+            print('    imported at startup: %s' % ', '.join(sorted(imported)))
+        failed = failed or total > budget or bool(imported)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Generates a synthetic album folder for the benchmarks:
+large JPEGs with EXIF orientation and DateTimeOriginal, PNGs with alpha channel and short
+MOV videos (only if ffmpeg is available). Every file has different content,
+so none of them is deduplicated by the uploader.
+"""
+from PIL import Image, ImageDraw
+import os
+import random
+import shutil
+import subprocess
+
+exif_orientation = 0x0112
+exif_ifd = 0x8769
+exif_date_time_original = 36867 #the date the uploader reads, in the Exif IFD
+orientations = (1, 3, 6, 8)
+
+def make_image(width, height, seed, mode = 'RGB'):
+    """Noise over a gradient with a few shapes - it compresses like a photo, not like a flat image"""
+    rnd = random.Random(seed)
+    im = Image.linear_gradient('L').resize((width, height)).convert(mode)
+    noise = Image.effect_noise((width, height), 40).convert(mode)
+    im = Image.blend(im, noise, 0.4)
+    draw = ImageDraw.Draw(im)
+    for i in range(20):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        r = rnd.randrange(width // 20, width // 5)
+        color = tuple(rnd.randrange(256) for c in mode)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill = color)
+    return im
+
+def make_jpeg(file_path, width, height, seed):
+    im = make_image(width, height, seed)
+    exif = Image.Exif()
+    exif[exif_orientation] = orientations[seed % len(orientations)]
+    exif.get_ifd(exif_ifd)[exif_date_time_original] = "2019:08:%02d %02d:%02d:00" % (1 + seed % 28, seed % 24, seed % 60)
+    im.save(file_path, 'JPEG', quality = 92, exif = exif)
+
+def make_png(file_path, width, height, seed):
+    im = make_image(width, height, seed, 'RGBA')
+    alpha = Image.radial_gradient('L').resize((width, height))
+    im.putalpha(alpha)
+    im.save(file_path, 'PNG')
+
+def has_ffmpeg():
+    return shutil.which('ffmpeg') is not None
+
+def make_video(file_path, seconds, seed):
+    cmd = ['ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'testsrc=duration=%d:size=1280x720:rate=30' % seconds,
+            '-f', 'lavfi', '-i', 'sine=frequency=%d:duration=%d' % (220 + seed * 10, seconds),
+            '-metadata', 'creation_time=2019-08-%02dT12:00:00Z' % (1 + seed % 28),
+            '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', file_path]
+    subprocess.run(cmd, check = True)
+
+def make_album(folder, images = 20, pngs = 5, videos = 2, size = (4000, 3000), video_seconds = 3):
+    """Creates the files of the album in the folder, returns their names.
+        The videos are skipped if ffmpeg isn't available."""
+    os.makedirs(folder, exist_ok = True)
+    file_names = []
+    for i in range(images):
+        file_names.append("img_%04d.jpg" % i)
+        make_jpeg(os.path.join(folder, file_names[-1]), size[0], size[1], i)
+    for i in range(pngs):
+        file_names.append("png_%04d.png" % i)
+        make_png(os.path.join(folder, file_names[-1]), size[0] // 2, size[1] // 2, images + i)
+    if videos and not has_ffmpeg():
+        print('ffmpeg is not available, no videos in the album')
+        videos = 0
+    for i in range(videos):
+        file_names.append("mov_%04d.mov" % i)
+        make_video(os.path.join(folder, file_names[-1]), video_seconds, i)
+    return file_names
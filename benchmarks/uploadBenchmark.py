@@ -0,0 +1,172 @@
+"""
+Throughput of the upload, -thumbnail and -update flows, offline.
+A synthetic album is generated into a temporary folder and uploaded into the
+in-process S3 stub (see s3Stub.py), so the numbers show the local work
+(hashing, probing, thumbnails, renditions, manifest) and the number of
+requests, not the network. -latency adds a delay to every request.
+
+For every flow it reports files/s, MB/s, the latency percentiles of the
+stages, the S3 requests by operation and the peak RSS, and saves them as JSON
+with the commit, so the results of two commits can be compared:
+
+    python benchmarks/uploadBenchmark.py -output before.json
+    python benchmarks/uploadBenchmark.py -output after.json
+    python benchmarks/uploadBenchmark.py -compare before.json after.json
+
+The stages are timed by the instrumentation of the uploader (see runStats.py).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    import resource
+except ImportError:
+    #not available on Windows, the peak RSS isn't reported there
+    resource = None
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_folder)
+
+import amazonUploader
+import localState
+from runStats import stats
+from s3Stub import S3Stub
+from syntheticAlbum import make_album
+
+album_name = "benchmark"
+
+def get_commit():
+    p = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = repo_folder,
+            stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    return p.stdout.decode('utf-8').strip() or 'unknown'
+
+def get_peak_rss_mb():
+    """Peak RSS of this process and of its finished worker processes (Linux reports kB, macOS bytes),
+        None if it isn't available"""
+    if resource is None:
+        return {'self': None, 'children': None}
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024 / 1024,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1024 / 1024}
+
+def get_stages():
+    """Returns the stage times of the run (see runStats.py) in ms"""
+    return {stage: {name: value * 1000 if name != 'count' else value for name, value in item.items()}
+            for stage, item in stats.get_summary()['stages'].items()}
+
+def run_flow(flow, stub, file_count, byte_count):
+    stub.requests.clear()
+    stats.reset()
+    start = time.perf_counter()
+    flow()
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds,
+            'files': file_count,
+            'files_per_second': file_count / seconds,
+            'mb_per_second': byte_count / 1024 / 1024 / seconds,
+            'stages': get_stages(),
+            'requests': dict(stub.requests),
+            'peak_rss_mb': get_peak_rss_mb()}
+
+def run(args):
+    work_folder = tempfile.mkdtemp(prefix = 'kepk_benchmark_')
+    folder = os.path.join(work_folder, album_name)
+    #the user state (cache, content index) of the benchmark is kept apart
+    localState.user_state_dir = os.path.join(work_folder, 'user_state')
+    print('Generate album: %s' % folder)
+    file_names = make_album(folder, args.images, args.pngs, args.videos, (args.width, args.height))
+    byte_count = sum(os.path.getsize(os.path.join(folder, file_name)) for file_name in file_names)
+
+    stub = S3Stub(args.latency)
+    new_uploader = lambda: amazonUploader.AmazonUploader(args.jobs, client = stub)
+
+    results = {'commit': get_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(), 'parameters': vars(args),
+            'album': {'files': len(file_names), 'bytes': byte_count}, 'flows': {}}
+    print('Upload: %d files, %.1f MB' % (len(file_names), byte_count / 1024 / 1024))
+    results['flows']['upload'] = run_flow(lambda: new_uploader().upload_all(folder, album_name),
+            stub, len(file_names), byte_count)
+
+    #the thumbnails are deleted, so -thumbnail makes all of them again
+    bucket = stub.buckets[amazonUploader.base_bucket_name + album_name]
+    for key in [key for key in bucket if key.startswith(amazonUploader.thumb_prefix)]:
+        del bucket[key]
+    print('Thumbnails: %d files' % len(file_names))
+    results['flows']['thumbnail'] = run_flow(lambda: new_uploader().update_with_thumbnails(folder, album_name),
+            stub, len(file_names), byte_count)
+
+    frontend_names = [item['name'] for item in amazonUploader.frontend_files]
+    print('Update: %d frontend files' % len(frontend_names))
+    results['flows']['update'] = run_flow(lambda: new_uploader().update_view(folder, album_name),
+            stub, len(frontend_names),
+            sum(os.path.getsize(os.path.join(repo_folder, name)) for name in frontend_names))
+    localState.get_state(folder).close()
+    return results
+
+def format_mb(value):
+    return 'n/a' if value is None else '%.0f MB' % value
+
+def print_results(results):
+    print('\nCommit %s, %d files, %.1f MB' % (results['commit'], results['album']['files'],
+            results['album']['bytes'] / 1024 / 1024))
+    for flow, result in results['flows'].items():
+        print('\n%s: %.2f s, %.2f files/s, %.2f MB/s, peak RSS %s (workers %s)' % (flow,
+                result['seconds'], result['files_per_second'], result['mb_per_second'],
+                format_mb(result['peak_rss_mb']['self']), format_mb(result['peak_rss_mb']['children'])))
+        print('    %-16s %6s %9s %9s %9s %9s' % ('stage (ms)', 'count', 'p50', 'p90', 'p99', 'max'))
+        for stage, summary in result['stages'].items():
+            print('    %-16s %6d %9.1f %9.1f %9.1f %9.1f' % (stage, summary['count'], summary['p50'],
+                    summary['p90'], summary['p99'], summary['max']))
+        print('    requests: %s' % ', '.join('%s %d' % item for item in sorted(result['requests'].items())))
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('%-10s %-16s %12s %12s %9s' % ('flow', 'metric', old['commit'], new['commit'], 'change'))
+    for flow in new['flows']:
+        if flow not in old['flows']:
+            continue
+        a, b = old['flows'][flow], new['flows'][flow]
+        metrics = [('files/s', a['files_per_second'], b['files_per_second']),
+                ('MB/s', a['mb_per_second'], b['mb_per_second']),
+                ('requests', sum(a['requests'].values()), sum(b['requests'].values()))]
+        if a['peak_rss_mb']['self'] is not None and b['peak_rss_mb']['self'] is not None:
+            metrics.append(('peak RSS MB', a['peak_rss_mb']['self'], b['peak_rss_mb']['self']))
+        for stage in b['stages']:
+            if stage in a['stages']:
+                metrics.append(('%s p50 ms' % stage, a['stages'][stage]['p50'], b['stages'][stage]['p50']))
+        for metric, old_value, new_value in metrics:
+            change = (new_value - old_value) * 100 / old_value if old_value else 0
+            print('%-10s %-16s %12.2f %12.2f %+8.1f%%' % (flow, metric, old_value, new_value, change))
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Offline benchmark of the upload flows')
+    parser.add_argument('-images', type = int, default = 20, help = 'Number of JPEGs (EXIF rotated)')
+    parser.add_argument('-pngs', type = int, default = 5, help = 'Number of PNGs with alpha')
+    parser.add_argument('-videos', type = int, default = 2, help = 'Number of MOVs (needs ffmpeg)')
+    parser.add_argument('-width', type = int, default = 4000, help = 'Width of the JPEGs')
+    parser.add_argument('-height', type = int, default = 3000, help = 'Height of the JPEGs')
+    parser.add_argument('-jobs', type = int, default = 1, help = 'Number of files processed in parallel')
+    parser.add_argument('-latency', type = float, default = 0, help = 'Seconds added to every S3 request')
+    parser.add_argument('-output', type = str, help = 'JSON file of the results (default: benchmark_<commit>.json)')
+    parser.add_argument('-compare', nargs = 2, metavar = ('OLD', 'NEW'), help = 'Compare two JSON results')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = run(args)
+    print_results(results)
+    output = args.output or 'benchmark_%s.json' % results['commit']
+    with open(output, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print('\nSaved: %s' % output)
+
+if __name__ == "__main__":
+    main()
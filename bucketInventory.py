@@ -0,0 +1,63 @@
+"""
+In-memory inventory of the objects of a bucket.
+The bucket is listed once (ListObjectsV2, 1000 keys per request) on the first
+query, then every existence and staleness check is answered from memory.
+The uploader records its own uploads, so the inventory stays up to date during a run.
+"""
+from runStats import measure
+import botocore.exceptions
+import threading
+from datetime import datetime, timezone
+
+class BucketInventory():
+    def __init__(self, client, bucket_name):
+        self._client = client
+        self._bucket_name = bucket_name
+        self._objects = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Lists all the objects of the bucket"""
+        objects = {}
+        paginator = self._client.get_paginator('list_objects_v2')
+        try:
+            with measure('inventory'):
+                for page in paginator.paginate(Bucket = self._bucket_name):
+                    for item in page.get('Contents', []):
+                        objects[item['Key']] = {'ContentLength': item['Size'],
+                                'ETag': item['ETag'],
+                                'LastModified': item['LastModified']}
+        except botocore.exceptions.ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code not in ('404', 'NoSuchBucket'):
+                raise
+        self._objects = objects
+
+    def _get_objects(self):
+        with self._lock:
+            if self._objects is None:
+                self.load()
+            return self._objects
+
+    def get(self, key):
+        """Returns the metadata (ContentLength, ETag, LastModified) of the key or None"""
+        return self._get_objects().get(key)
+
+    def exists(self, key):
+        return key in self._get_objects()
+
+    def keys(self):
+        return set(self._get_objects())
+
+    def add(self, key, size = None, etag = None):
+        """Records an object uploaded by this run"""
+        objects = self._get_objects()
+        with self._lock:
+            objects[key] = {'ContentLength': size,
+                    'ETag': etag,
+                    'LastModified': datetime.now(timezone.utc)}
+
+    def remove(self, key):
+        objects = self._get_objects()
+        with self._lock:
+            objects.pop(key, None)
@@ -1,119 +1,167 @@
-from datetime import datetime
-from moviepy.editor import *
-import os
-import PIL.ExifTags
-import re
-import subprocess
-
-image_ext = ".jpg", ".jpeg", ".png", ".gif"
-video_ext = ".mov", ".avi", ".m4v", ".mp4"
-
-def is_valid_path(path):
-    """Checks if the given path exists"""
-    return os.path.exists(path)
-
-def get_media_files(path):
-    """Returns the list of media files are in predefined folder"""
-    return [file_name.lower() for file_name in os.listdir(path)
-            if file_name.lower().endswith(image_ext + video_ext)]
-
-def is_video_file(file_path):
-    """Checks if the given file (with path) is a movie file"""
-    return file_path.lower().endswith(video_ext)
-
-def is_image_file(file_path):
-    """Checks if the given file (with path) is an image"""
-    return file_path.lower().endswith(image_ext)
-
-def get_exif(file_path):
-    result = {}
-    if is_image_file(file_path):
-        img = PIL.Image.open(file_path)
-        result = getattr(img, '_getexif', lambda: {})()
-        img.close()
-    return result if result != None else {}
-
-def get_video_metadata_creation_time(file_path):
-    result =  "0000-00-00 00:00:00"
-    try:
-        cmd = ['ffprobe', '-print_format', 'json', '-show_format', file_path]
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err =  p.communicate()
-        out = json.loads(out.decode('utf-8'))
-        result = out['format']['tags']['creation_time']
-    except (FileNotFoundError, KeyError) as e:
-        #it ffbpobe.exe or the keys are not availale
-        pass
-    return result
-
-def get_date_taken_from_file_name(file_name):
-    result = -1
-    match = re.search(r'\d{8}_\d{6}', file_name)
-    if match:
-        try:
-            date = datetime.strptime(match.group(), '%Y%m%d_%H%M%S')
-            result = date
-        except ValueError as ve:
-            pass
-    return result
-
-def get_date_taken_from_path(file_path, file_name):
-    date_taken = get_date_taken_from_file_name(file_name)
-    if date_taken == -1:
-        date_taken = os.path.getctime(file_path)
-        date_taken = datetime.fromtimestamp(date_taken)
-    return date_taken
-
-def get_formed_date_taken(file_path, file_name, date_value, zero_value, date_format):
-    if date_value != zero_value:
-        date_taken = datetime.strptime(date_value, date_format)
-    else:
-        date_taken = get_date_taken_from_path(file_path, file_name)
-    return date_taken
-
-def get_date_taken(file_path, file_name):
-    date_taken = 0
-    if is_image_file(file_path):
-        exif_info = get_exif(file_path)
-        date_taken = exif_info.get(36867, "0000:00:00 00:00:00")
-        date_taken = get_formed_date_taken(file_path, file_name, date_taken,
-                "0000:00:00 00:00:00", "%Y:%m:%d %H:%M:%S")
-    elif is_video_file(file_path):
-        date_taken = get_video_metadata_creation_time(file_path)
-        date_taken = get_formed_date_taken(file_path, file_name, date_taken,
-                "0000-00-00 00:00:00", "%Y-%m-%d %H:%M:%S")
-    date_taken = date_taken.strftime('%Y%m%d%H%M%S')
-    return date_taken
-
-def get_orientation(file_path):
-    exif_info = get_exif(file_path)
-    return exif_info.get(274, 1)
-
-def get_duration(file_path, file_name):
-    result = 0
-    if is_video_file(file_name):
-        clip = VideoFileClip(file_path)
-        result = clip.duration
-    return result
-
-def get_file_info(file_path, file_name):
-    """get useful exif info of the file"""
-    result = {}
-    result['size'] = get_size(file_path)
-    result['date_taken'] = get_date_taken(file_path, file_name)
-    result['orient'] = get_orientation(file_path)
-    result['duration'] = get_duration(file_path, file_name)
-    return result
-
-def get_size(file_path):
-    """Returns the size of the given file in MB"""
-    precision = 2
-    sizes = ((1024*1024, "MB"), (1024, "Kb"), (2, "bytes"), (1, "byte"))
-    if not is_valid_path(file_path):
-        return '{}{}'.format(0, 'MB')
-    size_in_bytes = os.path.getsize(file_path)
-    for min_size, abbrev in sizes:
-        if size_in_bytes >= min_size:
-            return '{} {}'.format(
-                    round(size_in_bytes / min_size, precision),
-                    abbrev)
+from datetime import datetime
+import os
+import PIL.Image
+import PIL.ExifTags
+import re
+import videoBackend
+
+image_ext = ".jpg", ".jpeg", ".png", ".gif"
+video_ext = ".mov", ".avi", ".m4v", ".mp4"
+
+def is_valid_path(path):
+    """Checks if the given path exists"""
+    return os.path.exists(path)
+
+def get_media_files(path):
+    """Returns the list of media files are in predefined folder"""
+    return [file_name.lower() for file_name in os.listdir(path)
+            if file_name.lower().endswith(image_ext + video_ext)]
+
+def is_video_file(file_path):
+    """Checks if the given file (with path) is a movie file"""
+    return file_path.lower().endswith(video_ext)
+
+def is_image_file(file_path):
+    """Checks if the given file (with path) is an image"""
+    return file_path.lower().endswith(image_ext)
+
+class MediaInfo(object):
+    """Metadata of a media file, collected with one open of the file.
+        For images the opened (not yet decoded) image is kept in _image_,
+        so the thumbnail can be made from it without opening the file again."""
+    __slots__ = ('date_taken', 'orientation', 'width', 'height', 'duration', 'rotation', 'image')
+
+    def __init__(self):
+        self.date_taken = None
+        self.orientation = 1
+        self.width = 0
+        self.height = 0
+        self.duration = 0
+        self.rotation = 0
+        self.image = None
+
+    def close(self):
+        if self.image is not None:
+            self.image.close()
+            self.image = None
+
+def get_exif_of_image(img):
+    result = getattr(img, '_getexif', lambda: {})()
+    return result if result != None else {}
+
+def get_exif(file_path):
+    result = {}
+    if is_image_file(file_path):
+        img = PIL.Image.open(file_path)
+        result = get_exif_of_image(img)
+        img.close()
+    return result
+
+def probe_image(file_path, keep_image = False):
+    """Reads the metadata of an image with one open"""
+    info = MediaInfo()
+    img = PIL.Image.open(file_path)
+    exif_info = get_exif_of_image(img)
+    info.date_taken = exif_info.get(36867, "0000:00:00 00:00:00")
+    info.orientation = exif_info.get(274, 1)
+    info.width, info.height = img.size
+    if keep_image:
+        info.image = img
+    else:
+        img.close()
+    return info
+
+def probe_video(file_path):
+    """Reads the metadata of a video with one ffprobe call"""
+    video = videoBackend.probe(file_path)
+    info = MediaInfo()
+    info.date_taken = video['creation_time']
+    info.duration = video['duration']
+    info.width = video['width']
+    info.height = video['height']
+    info.rotation = video['rotation']
+    return info
+
+def probe_media(file_path, file_name, keep_image = False):
+    """Returns the MediaInfo of the given file.
+        The file is opened once (or ffprobe is called once for videos)."""
+    if is_image_file(file_path):
+        info = probe_image(file_path, keep_image)
+        info.date_taken = get_formed_date_taken(file_path, file_name, info.date_taken,
+                "0000:00:00 00:00:00", "%Y:%m:%d %H:%M:%S")
+    elif is_video_file(file_path):
+        info = probe_video(file_path)
+        info.date_taken = get_formed_date_taken(file_path, file_name, info.date_taken,
+                videoBackend.zero_creation_time, "%Y-%m-%d %H:%M:%S")
+    else:
+        info = MediaInfo()
+        info.date_taken = get_date_taken_from_path(file_path, file_name)
+    return info
+
+def get_video_metadata_creation_time(file_path):
+    return probe_video(file_path).date_taken
+
+def get_date_taken_from_file_name(file_name):
+    result = -1
+    match = re.search(r'\d{8}_\d{6}', file_name)
+    if match:
+        try:
+            date = datetime.strptime(match.group(), '%Y%m%d_%H%M%S')
+            result = date
+        except ValueError as ve:
+            pass
+    return result
+
+def get_date_taken_from_path(file_path, file_name):
+    date_taken = get_date_taken_from_file_name(file_name)
+    if date_taken == -1:
+        date_taken = os.path.getctime(file_path)
+        date_taken = datetime.fromtimestamp(date_taken)
+    return date_taken
+
+def get_formed_date_taken(file_path, file_name, date_value, zero_value, date_format):
+    if date_value != zero_value:
+        date_taken = datetime.strptime(date_value, date_format)
+    else:
+        date_taken = get_date_taken_from_path(file_path, file_name)
+    return date_taken
+
+def get_date_taken(file_path, file_name):
+    return probe_media(file_path, file_name).date_taken.strftime('%Y%m%d%H%M%S')
+
+def get_orientation(file_path):
+    exif_info = get_exif(file_path)
+    return exif_info.get(274, 1)
+
+def get_duration(file_path, file_name):
+    result = 0
+    if is_video_file(file_name):
+        result = probe_video(file_path).duration
+    return result
+
+def get_file_info(file_path, file_name, media = None):
+    """get useful exif info of the file
+        If the MediaInfo of the file is not given, the file is probed."""
+    if media is None:
+        media = probe_media(file_path, file_name)
+    result = {}
+    result['size'] = get_size(file_path)
+    result['date_taken'] = media.date_taken.strftime('%Y%m%d%H%M%S')
+    result['orient'] = media.orientation
+    result['duration'] = media.duration
+    result['width'] = media.width
+    result['height'] = media.height
+    return result
+
+def get_size(file_path):
+    """Returns the size of the given file in MB"""
+    precision = 2
+    sizes = ((1024*1024, "MB"), (1024, "Kb"), (2, "bytes"), (1, "byte"))
+    if not is_valid_path(file_path):
+        return '{}{}'.format(0, 'MB')
+    size_in_bytes = os.path.getsize(file_path)
+    for min_size, abbrev in sizes:
+        if size_in_bytes >= min_size:
+            return '{} {}'.format(
+                    round(size_in_bytes / min_size, precision),
+                    abbrev)
@@ -0,0 +1,113 @@
+"""
+Watches an album folder for new and changed media files.
+inotify (through the watchdog package) is used if it is installed, otherwise
+the folder is polled. A file is reported only when its size and modification
+time haven't changed for `settle` seconds, so a file which is still being
+copied (or written by a tethered camera) isn't uploaded half-written.
+"""
+from fileInfo import image_ext, video_ext
+import os
+import queue
+import time
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+def is_media_file(file_name):
+    return file_name.lower().endswith(image_ext + video_ext)
+
+def get_fingerprint(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError as e:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class EventHandler(FileSystemEventHandler):
+    """Puts the names of the created, modified and moved-in files into the queue"""
+    def __init__(self, events):
+        self._events = events
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        file_path = getattr(event, 'dest_path', None) or event.src_path
+        if is_media_file(file_path):
+            self._events.put(os.path.basename(file_path))
+
+class FolderWatcher():
+    def __init__(self, path, settle = 2.0, poll_interval = 2.0):
+        """settle: seconds a file must be unchanged before it is reported
+            poll_interval: seconds between two scans of the folder if inotify isn't available"""
+        self._path = path
+        self._settle = settle
+        self._poll_interval = poll_interval
+        self._pending = {} #file name: (fingerprint, unchanged since)
+        self._reported = {} #file name: fingerprint
+        self._events = queue.Queue()
+        self._last_scan = None
+        self._observer = None
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(EventHandler(self._events), path, recursive = False)
+            self._observer.start()
+
+    def uses_inotify(self):
+        return self._observer is not None
+
+    def scan(self):
+        """Checks every media file of the folder"""
+        for entry in os.scandir(self._path):
+            if entry.is_file() and is_media_file(entry.name):
+                stat = entry.stat()
+                if self._reported.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    self._check(entry.name)
+        self._last_scan = time.monotonic()
+
+    def _check(self, file_name):
+        if file_name not in self._pending:
+            self._pending[file_name] = (None, time.monotonic())
+
+    def wait(self, timeout):
+        """Waits at most timeout seconds and returns the (lower case) names of
+            the files which have settled since the last call"""
+        deadline = time.monotonic() + timeout
+        #the first scan finds the files which came while nobody watched
+        if self._last_scan is None or (self._observer is None
+                and time.monotonic() - self._last_scan >= self._poll_interval):
+            self.scan()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                self._check(self._events.get(timeout = remaining))
+            except queue.Empty as e:
+                break
+        return self._get_settled()
+
+    def _get_settled(self):
+        now = time.monotonic()
+        settled = []
+        for file_name, (fingerprint, since) in list(self._pending.items()):
+            current = get_fingerprint(os.path.join(self._path, file_name))
+            if current is None:
+                #deleted or moved away
+                del self._pending[file_name]
+            elif current != fingerprint:
+                self._pending[file_name] = (current, now)
+            elif now - since >= self._settle:
+                del self._pending[file_name]
+                if self._reported.get(file_name) != current:
+                    self._reported[file_name] = current
+                    settled.append(file_name.lower())
+        return settled
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
@@ -1,211 +1,435 @@
-const thumbsCont = document.getElementById("thumbs-main");
-const nrOfImages = 15; //nr of half of the images in thumbs container -1
-
-function loadItem(catalog, idx) {
-    let main = document.getElementById("main");
-    let item = catalog[idx];
-    if (item.type == "img") {
-        let img = document.createElement("img");
-        img.classList.add("main-image");
-        img.src = item.src;
-        let orient = item.orient
-        switch (orient) {
-            case 6:
-                img.classList.add("rotate90");
-                break;
-            case 3:
-                img.classList.add("rotate180");
-                break;
-            case 8:
-                img.classList.add("rotate270");
-                break;
-            default:
-                img.classList.add("rotate0");
-        }
-        main.replaceChild(img, main.childNodes[0]);
-    } else if (item.type == "vid") {
-        let vid = document.createElement("video");
-        vid.src = item.src;
-        vid.controls = true;
-        vid.classList.add("main-image");
-        vid.classList.add("rotate0");
-        main.replaceChild(vid, main.childNodes[0]);
-    }
-
-    document.getElementById("prev").onclick = function () {
-        loadItem(catalog, calculateIndex(idx, -1, catalog.length));
-        return false;
-    };
-
-    document.getElementById("next").onclick = function () {
-        loadItem(catalog, calculateIndex(idx, 1, catalog.length));
-    };
-
-    document.onkeydown = function (event) {
-        const keyDown = event.key;
-        switch (keyDown) {
-            case "ArrowLeft":
-                loadItem(catalog, calculateIndex(idx, -1, catalog.length));
-                break;
-            case 'ArrowRight':
-                loadItem(catalog, calculateIndex(idx, 1, catalog.length));
-                break;
-        }
-    };
-
-    loadThumbnails(catalog, idx);
-}
-
-function init() {
-    fetch("photos.json")
-        .then(function (catalog) {
-            return catalog.json();
-        })
-        .then(function (jsonCatalog) {
-            loadItem(jsonCatalog, 0);
-        })
-}
-
-function loadThumbnails(catalog, idx) {
-    if (thumbsCont == null) {
-        return false;
-    }
-    //remove previous images from thumbs container
-    while (thumbsCont.lastChild) {
-        thumbsCont.removeChild(thumbsCont.lastChild);
-    }
-
-    let catalogLength = catalog.length;
-    let firsIdx = calculateIndex(idx, - nrOfImages, catalogLength);
-    let lastIdx = calculateIndex(idx, nrOfImages, catalogLength);
-
-    for (i = - nrOfImages; i <= nrOfImages; i++) {
-        if (i == 0) {
-            addMediaToThumbs(catalog, idx, i, true);
-        } else {
-            addMediaToThumbs(catalog, idx, i, false);
-        }
-    }
-
-    document.getElementById("thumbs-prev").onclick = function () {
-        thumbsCont.removeChild(thumbsCont.lastChild);
-        lastIdx = calculateIndex(lastIdx, -1, catalogLength);
-        firsIdx = calculateIndex(firsIdx, -1, catalogLength);
-        let imgContainer = createImageContainer(false);
-        thumbsCont.insertBefore(imgContainer, thumbsCont.firstChild);
-        loadMdiaItem(imgContainer, catalog, firsIdx);
-    };
-
-    document.getElementById("thumbs-next").onclick = function () {
-        thumbsCont.removeChild(thumbsCont.firstChild);
-        lastIdx = calculateIndex(lastIdx, +1, catalogLength);
-        firsIdx = calculateIndex(firsIdx, +1, catalogLength);
-        addMediaToThumbs(catalog, lastIdx, 0, false);
-    };
-
-    thumbsCont.style.width = calculateWidthForContainer(nrOfImages, 100) + "px";
-    thumbsCont.style.marginLeft = calculateMarginLeft(nrOfImages, 100) + "px";
-}
-
-function calculateIndex(originalIndex, step, dataLength) {
-    result = (originalIndex + step + dataLength) % dataLength;
-    if (result < 0) { //in case if there are less images then nrOfImages
-        result += dataLength;
-    }
-    return result;
-}
-
-function addMediaToThumbs(catalog, idx, step, selected) {
-    let imgContainer = createImageContainer(selected)
-    thumbsCont.appendChild(imgContainer);
-    let cIdx = calculateIndex(idx, step, catalog.length);
-    loadMdiaItem(imgContainer, catalog, cIdx);
-}
-
-function createImageContainer(selected) {
-    let imgCont = document.createElement('div');
-    imgCont.classList.add('thumbs-div');
-    if (selected) {
-        imgCont.classList.add('selected');
-    }
-    return imgCont;
-}
-
-function loadMdiaItem(parentContainer, catalog, index) {
-    let cItem = catalog[index];
-    let cImg = document.createElement("img");
-    if (cItem.hasOwnProperty("thumbnail")) {
-        /*        fetch(cItem.thumbnail)
-                .then(res => {
-                    if (res.ok) {
-                        cImg.src = cItem.thumbnail;
-                    } else {
-                        cImg.src = "noThumbnail.jpg";
-                    }
-                }).catch(err => cImg.src = "noThumbnail.jpg");*/
-        cImg.src = cItem.thumbnail;
-        //if the image can not be loaded
-        cImg.addEventListener("error", function (event) {
-            event.target.src = "noThumbnail.jpg";
-            event.onerror = null;
-        });
-    } else {
-        cImg.src = "noThumbnail.jpg";
-    }
-
-    cImg.onclick = function () {
-        loadItem(catalog, index);
-    }
-
-    parentContainer.appendChild(cImg);
-
-    if (cItem.type == "vid") {
-        if (cItem.hasOwnProperty("duration")){
-            let videDuration = document.createElement('div');
-            videDuration.classList.add('thumbs-video-duration');
-            videDuration.innerHTML = formatDuration(Math.floor(cItem.duration));
-            videDuration.onclick = function () {
-                loadItem(catalog, index);
-            }
-            parentContainer.appendChild(videDuration);
-        }
-
-        let videPlayIcon = document.createElement('div');
-        videPlayIcon.classList.add('thumbs-video-play');
-        videPlayIcon.innerHTML = "&nbsp";
-        videPlayIcon.onclick = function () {
-            loadItem(catalog, index);
-        }
-        parentContainer.appendChild(videPlayIcon);
-    }
-}
-
-function calculateWidthForContainer(nrOfImages, imageWidth) {
-    return (2 * nrOfImages + 1) * imageWidth;
-}
-
-function calculateMarginLeft(nrOfImages, imageWidth) {
-    let cWidth = calculateWidthForContainer(nrOfImages, imageWidth);
-    let visibleWidth = document.getElementById("thumbs").offsetWidth;
-    //console.log(visibleWidth);
-    let marginLeftValue = Math.round(- (cWidth - visibleWidth + 3 * imageWidth) / 2);
-    //console.log(marginLeftValue);
-    return marginLeftValue;
-}
-
-function formatDuration(duration) {
-    let result = "";
-    let hours = 0;
-    let minutes = Math.floor(duration / 60);
-    let seconds = duration - minutes * 60;
-    if (minutes >= 60) {
-        hours = Math.floor(minutes / 60);
-        minutes -= hours * 60;
-        result += (hours < 10 ? "0" + hours : hours) + ":";
-    }
-    result += (minutes < 10 ? "0" + minutes : minutes) + ":";
-    result += seconds < 10 ? "0" + seconds : seconds;
-    return result;
-}
-
+const thumbsCont = document.getElementById("thumbs-main");
+const nrOfImages = 15; //nr of half of the images in thumbs container -1
+const renditionSizes = "90vw"; //displayed width of the main image, for choosing the rendition
+const spriteColumns = 8; //size of the sprite sheets, as in thumbnails.py
+const spriteRows = 8;
+const mainWidth = 0.9; //size of the main image compared to the window, as in style.css
+const mainHeight = 0.75;
+
+function createPicture(item) {
+    //renditions are already turned, the browser picks the smallest adequate one
+    let picture = document.createElement("picture");
+    let webp = item.renditions.filter(r => r.hasOwnProperty("webp"));
+    if (webp.length > 0) {
+        let source = document.createElement("source");
+        source.type = "image/webp";
+        source.srcset = webp.map(r => r.webp + " " + r.w + "w").join(", ");
+        source.sizes = renditionSizes;
+        picture.appendChild(source);
+    }
+    let img = document.createElement("img");
+    img.classList.add("main-image");
+    img.classList.add("rotate0");
+    img.srcset = item.renditions.map(r => r.src + " " + r.w + "w").join(", ");
+    img.sizes = renditionSizes;
+    img.src = item.renditions[Math.min(1, item.renditions.length - 1)].src;
+    picture.appendChild(img);
+    return picture;
+}
+
+function getDisplaySize(item) {
+    //size of the image after turning it by its orientation
+    if (item.hasOwnProperty("renditions") && item.renditions.length > 0) {
+        let largest = item.renditions[item.renditions.length - 1];
+        return [largest.w, largest.h];
+    }
+    if (!item.width || !item.height) {
+        return null;
+    }
+    return item.orient >= 5 ? [item.height, item.width] : [item.width, item.height];
+}
+
+const base83Chars = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~";
+
+function decodeBase83(str) {
+    let value = 0;
+    for (let c of str) {
+        value = value * 83 + base83Chars.indexOf(c);
+    }
+    return value;
+}
+
+function srgbToLinear(value) {
+    let v = value / 255;
+    return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+}
+
+function linearToSrgb(value) {
+    let v = Math.max(0, Math.min(1, value));
+    return v <= 0.0031308 ? Math.round(v * 12.92 * 255) : Math.round((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255);
+}
+
+function decodeBlurhash(blurhash, width, height) {
+    //returns the image of the BlurHash (made by thumbnails.py) as a data url
+    let sizeFlag = decodeBase83(blurhash[0]);
+    let numX = (sizeFlag % 9) + 1;
+    let numY = Math.floor(sizeFlag / 9) + 1;
+    let maximum = (decodeBase83(blurhash[1]) + 1) / 166;
+    let colors = [];
+    let dc = decodeBase83(blurhash.substring(2, 6));
+    colors.push([srgbToLinear(dc >> 16), srgbToLinear((dc >> 8) & 255), srgbToLinear(dc & 255)]);
+    for (let i = 1; i < numX * numY; i++) {
+        let value = decodeBase83(blurhash.substring(4 + i * 2, 6 + i * 2));
+        colors.push([Math.floor(value / (19 * 19)), Math.floor(value / 19) % 19, value % 19].map(function (q) {
+            let v = (q - 9) / 9;
+            return Math.sign(v) * v * v * maximum;
+        }));
+    }
+    let canvas = document.createElement("canvas");
+    canvas.width = width;
+    canvas.height = height;
+    let context = canvas.getContext("2d");
+    let imageData = context.createImageData(width, height);
+    for (let y = 0; y < height; y++) {
+        for (let x = 0; x < width; x++) {
+            let rgb = [0, 0, 0];
+            for (let j = 0; j < numY; j++) {
+                for (let i = 0; i < numX; i++) {
+                    let basis = Math.cos(Math.PI * x * i / width) * Math.cos(Math.PI * y * j / height);
+                    let color = colors[i + j * numX];
+                    rgb = rgb.map((c, k) => c + color[k] * basis);
+                }
+            }
+            let p = 4 * (x + y * width);
+            imageData.data[p] = linearToSrgb(rgb[0]);
+            imageData.data[p + 1] = linearToSrgb(rgb[1]);
+            imageData.data[p + 2] = linearToSrgb(rgb[2]);
+            imageData.data[p + 3] = 255;
+        }
+    }
+    context.putImageData(imageData, 0, 0);
+    return canvas.toDataURL();
+}
+
+function createPlaceholder(item) {
+    //the BlurHash of the manifest, blown up to the size of the main image
+    let size = getDisplaySize(item);
+    if (!item.hasOwnProperty("blurhash") || size == null) {
+        return null;
+    }
+    let placeholder = document.createElement("img");
+    let ratio = size[0] / size[1];
+    placeholder.src = decodeBlurhash(item.blurhash, ratio >= 1 ? 32 : Math.round(32 * ratio), ratio >= 1 ? Math.round(32 / ratio) : 32);
+    placeholder.classList.add("main-image");
+    placeholder.classList.add("rotate0");
+    placeholder.classList.add("placeholder");
+    let scale = Math.min(window.innerWidth * mainWidth / size[0], window.innerHeight * mainHeight / size[1]);
+    placeholder.style.width = Math.round(size[0] * scale) + "px";
+    placeholder.style.height = Math.round(size[1] * scale) + "px";
+    return placeholder;
+}
+
+function showMainImage(main, item, element, img) {
+    //the placeholder is shown until the image is loaded
+    let placeholder = createPlaceholder(item);
+    if (placeholder == null || img.complete) {
+        main.replaceChild(element, main.childNodes[0]);
+        return;
+    }
+    main.replaceChild(placeholder, main.childNodes[0]);
+    let show = function () {
+        //if an other item hasn't been loaded since
+        if (placeholder.parentNode == main) {
+            main.replaceChild(element, placeholder);
+        }
+    };
+    img.addEventListener("load", show);
+    img.addEventListener("error", show);
+}
+
+function prefetchNeighbours(catalog, idx) {
+    //loads the renditions of the previous and next items, when the browser is idle
+    let idle = window.requestIdleCallback || (callback => setTimeout(callback, 200));
+    idle(function () {
+        [-1, 1].forEach(function (step) {
+            let nIdx = calculateIndex(idx, step, catalog.length);
+            loadCatalogPage(catalog, nIdx).then(function () {
+                let item = getCatalogItem(catalog, nIdx);
+                if (item.type == "img" && item.hasOwnProperty("renditions") && item.renditions.length > 0) {
+                    //the browser picks the same rendition as for the main image
+                    createPicture(item);
+                }
+            });
+        });
+    });
+}
+
+function createCatalog(root) {
+    //the catalog knows every page of the manifest, but loads them only when needed
+    let catalog = { length: root.count, pages: [] };
+    let start = 0;
+    root.pages.forEach(function (page) {
+        catalog.pages.push({ key: page.key, start: start, count: page.count, items: null, loading: null });
+        start += page.count;
+    });
+    return catalog;
+}
+
+function createCatalogFromList(items) {
+    //old albums have only one photos.json
+    return { length: items.length, pages: [{ key: null, start: 0, count: items.length, items: items, loading: null }] };
+}
+
+function findCatalogPage(catalog, idx) {
+    return catalog.pages.find(page => idx >= page.start && idx < page.start + page.count);
+}
+
+function getCatalogItem(catalog, idx) {
+    let page = findCatalogPage(catalog, idx);
+    if (page == null || page.items == null) {
+        return null;
+    }
+    return page.items[idx - page.start];
+}
+
+function loadCatalogPage(catalog, idx) {
+    //returns a promise which is resolved when the page of the idx-th item is loaded
+    let page = findCatalogPage(catalog, idx);
+    if (page.items != null) {
+        return Promise.resolve(page);
+    }
+    if (page.loading == null) {
+        page.loading = fetch(page.key)
+            .then(res => res.json())
+            .then(function (items) {
+                page.items = items;
+                return page;
+            });
+    }
+    return page.loading;
+}
+
+function loadItem(catalog, idx) {
+    let main = document.getElementById("main");
+    let item = getCatalogItem(catalog, idx);
+    if (item == null) {
+        loadCatalogPage(catalog, idx).then(() => loadItem(catalog, idx));
+        return;
+    }
+    let original = document.getElementById("original");
+    if (original != null) {
+        original.href = item.src;
+    }
+    if (item.type == "img" && item.hasOwnProperty("renditions") && item.renditions.length > 0) {
+        let picture = createPicture(item);
+        showMainImage(main, item, picture, picture.querySelector("img"));
+    } else if (item.type == "img") {
+        let img = document.createElement("img");
+        img.classList.add("main-image");
+        img.src = item.src;
+        let orient = item.orient
+        switch (orient) {
+            case 6:
+                img.classList.add("rotate90");
+                break;
+            case 3:
+                img.classList.add("rotate180");
+                break;
+            case 8:
+                img.classList.add("rotate270");
+                break;
+            default:
+                img.classList.add("rotate0");
+        }
+        showMainImage(main, item, img, img);
+    } else if (item.type == "vid") {
+        let vid = document.createElement("video");
+        //the proxy is a small MP4 with its index at the front, it starts at once
+        if (item.hasOwnProperty("proxy")) {
+            vid.src = item.proxy.src;
+            if (item.proxy.hasOwnProperty("poster")) {
+                vid.poster = item.proxy.poster;
+            }
+        } else {
+            vid.src = item.src;
+        }
+        vid.preload = "metadata";
+        vid.controls = true;
+        vid.classList.add("main-image");
+        vid.classList.add("rotate0");
+        main.replaceChild(vid, main.childNodes[0]);
+    }
+
+    document.getElementById("prev").onclick = function () {
+        loadItem(catalog, calculateIndex(idx, -1, catalog.length));
+        return false;
+    };
+
+    document.getElementById("next").onclick = function () {
+        loadItem(catalog, calculateIndex(idx, 1, catalog.length));
+    };
+
+    document.onkeydown = function (event) {
+        const keyDown = event.key;
+        switch (keyDown) {
+            case "ArrowLeft":
+                loadItem(catalog, calculateIndex(idx, -1, catalog.length));
+                break;
+            case 'ArrowRight':
+                loadItem(catalog, calculateIndex(idx, 1, catalog.length));
+                break;
+        }
+    };
+
+    loadThumbnails(catalog, idx);
+    prefetchNeighbours(catalog, idx);
+}
+
+function init() {
+    fetch("manifest.json")
+        .then(function (res) {
+            if (res.ok) {
+                return res.json().then(createCatalog);
+            }
+            return fetch("photos.json")
+                .then(catalog => catalog.json())
+                .then(createCatalogFromList);
+        })
+        .then(function (catalog) {
+            loadItem(catalog, 0);
+        })
+}
+
+function loadThumbnails(catalog, idx) {
+    if (thumbsCont == null) {
+        return false;
+    }
+    //the thumbnail nodes are created once and reused on every step
+    if (thumbsCont.childElementCount == 0) {
+        for (let i = - nrOfImages; i <= nrOfImages; i++) {
+            thumbsCont.appendChild(createImageContainer(false));
+        }
+        thumbsCont.style.width = calculateWidthForContainer(nrOfImages, 100) + "px";
+        thumbsCont.style.marginLeft = calculateMarginLeft(nrOfImages, 100) + "px";
+    }
+
+    let firsIdx = calculateIndex(idx, - nrOfImages, catalog.length);
+    showThumbnails(catalog, firsIdx, idx);
+
+    document.getElementById("thumbs-prev").onclick = function () {
+        firsIdx = calculateIndex(firsIdx, -1, catalog.length);
+        showThumbnails(catalog, firsIdx, idx);
+    };
+
+    document.getElementById("thumbs-next").onclick = function () {
+        firsIdx = calculateIndex(firsIdx, +1, catalog.length);
+        showThumbnails(catalog, firsIdx, idx);
+    };
+}
+
+function showThumbnails(catalog, firsIdx, selectedIdx) {
+    Array.from(thumbsCont.children).forEach(function (imgContainer, i) {
+        let cIdx = calculateIndex(firsIdx, i, catalog.length);
+        imgContainer.classList.toggle("selected", cIdx == selectedIdx);
+        loadMdiaItem(imgContainer, catalog, cIdx);
+    });
+}
+
+function calculateIndex(originalIndex, step, dataLength) {
+    result = (originalIndex + step + dataLength) % dataLength;
+    if (result < 0) { //in case if there are less images then nrOfImages
+        result += dataLength;
+    }
+    return result;
+}
+
+function createImageContainer(selected) {
+    let imgCont = document.createElement('div');
+    imgCont.classList.add('thumbs-div');
+    if (selected) {
+        imgCont.classList.add('selected');
+    }
+    //tile from a sprite sheet
+    let tile = document.createElement('div');
+    tile.classList.add('thumbs-tile');
+    imgCont.appendChild(tile);
+    //separate thumbnail, if the item is not on a sprite sheet
+    let cImg = document.createElement("img");
+    cImg.addEventListener("error", function (event) {
+        //if the image can not be loaded
+        if (!event.target.src.endsWith("noThumbnail.jpg")) {
+            event.target.src = "noThumbnail.jpg";
+        }
+    });
+    imgCont.appendChild(cImg);
+    let videDuration = document.createElement('div');
+    videDuration.classList.add('thumbs-video-duration');
+    imgCont.appendChild(videDuration);
+    let videPlayIcon = document.createElement('div');
+    videPlayIcon.classList.add('thumbs-video-play');
+    videPlayIcon.innerHTML = "&nbsp";
+    imgCont.appendChild(videPlayIcon);
+    return imgCont;
+}
+
+function showNode(node, visible) {
+    node.style.display = visible ? "" : "none";
+}
+
+function loadMdiaItem(parentContainer, catalog, index) {
+    parentContainer.dataset.index = index;
+    let cItem = getCatalogItem(catalog, index);
+    if (cItem == null) {
+        loadCatalogPage(catalog, index).then(function () {
+            //the container may show an other item since
+            if (parentContainer.dataset.index == index) {
+                loadMdiaItem(parentContainer, catalog, index);
+            }
+        });
+        return;
+    }
+    let [tile, cImg, videDuration, videPlayIcon] = parentContainer.children;
+    if (cItem.hasOwnProperty("sprite")) {
+        let [sheet, column, row] = cItem.sprite;
+        tile.style.backgroundImage = "url(\"" + sheet + "\")";
+        tile.style.backgroundPosition = (column * 100 / (spriteColumns - 1)) + "% " + (row * 100 / (spriteRows - 1)) + "%";
+        showNode(tile, true);
+        showNode(cImg, false);
+    } else {
+        let src = cItem.hasOwnProperty("thumbnail") ? cItem.thumbnail : "noThumbnail.jpg";
+        if (cImg.getAttribute("src") != src) {
+            cImg.src = src;
+        }
+        showNode(tile, false);
+        showNode(cImg, true);
+    }
+
+    parentContainer.onclick = function () {
+        loadItem(catalog, index);
+    }
+
+    let hasDuration = cItem.type == "vid" && cItem.hasOwnProperty("duration");
+    videDuration.innerHTML = hasDuration ? formatDuration(Math.floor(cItem.duration)) : "";
+    showNode(videDuration, hasDuration);
+    showNode(videPlayIcon, cItem.type == "vid");
+}
+
+function calculateWidthForContainer(nrOfImages, imageWidth) {
+    return (2 * nrOfImages + 1) * imageWidth;
+}
+
+function calculateMarginLeft(nrOfImages, imageWidth) {
+    let cWidth = calculateWidthForContainer(nrOfImages, imageWidth);
+    let visibleWidth = document.getElementById("thumbs").offsetWidth;
+    //console.log(visibleWidth);
+    let marginLeftValue = Math.round(- (cWidth - visibleWidth + 3 * imageWidth) / 2);
+    //console.log(marginLeftValue);
+    return marginLeftValue;
+}
+
+function formatDuration(duration) {
+    let result = "";
+    let hours = 0;
+    let minutes = Math.floor(duration / 60);
+    let seconds = duration - minutes * 60;
+    if (minutes >= 60) {
+        hours = Math.floor(minutes / 60);
+        minutes -= hours * 60;
+        result += (hours < 10 ? "0" + hours : hours) + ":";
+    }
+    result += (minutes < 10 ? "0" + minutes : minutes) + ":";
+    result += seconds < 10 ? "0" + seconds : seconds;
+    return result;
+}
+
 init();
\ No newline at end of file
@@ -0,0 +1,346 @@
+"""
+Local state of an album folder.
+The state is kept in an sqlite database in the folder: the album name and,
+for every file, its size, modification time, hash and which of its objects
+(original, thumbnail, manifest record) have been uploaded, and the unfinished
+multipart uploads.
+The files table is also the journal of the runs: a file is recorded with its
+hash and manifest record as soon as it is prepared, and every object is marked
+the moment it is uploaded, so a new run continues with the missing stages.
+The old .amazonUploader config file is migrated into the database on first use.
+"""
+import configparser
+import json
+import os
+import sqlite3
+import threading
+import time
+
+state_file = ".amazonUploader.db"
+user_state_dir = os.path.join(os.path.expanduser("~"), ".amazon_uploader") #state shared by all the albums
+cache_file = "cache.db"
+content_file = "contents.db"
+legacy_hash_file = ".amazonUploader" #albumname and file-hash pairs of the older versions
+legacy_hash_photos = "Photos"
+legacy_hash_album = "Album"
+album_key = "album"
+
+#status of an uploaded object
+not_uploaded = 0
+uploaded = 1
+stages = ("original", "thumbnail", "manifest")
+
+schema = (
+    """CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS files (
+        filename TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime_ns INTEGER,
+        sha256 TEXT,
+        original INTEGER NOT NULL DEFAULT 0,
+        thumbnail INTEGER NOT NULL DEFAULT 0,
+        manifest INTEGER NOT NULL DEFAULT 0,
+        updated REAL)""",
+    """CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)""",
+)
+
+#changes of the schema, the n-th one upgrades the database to version n+1
+migrations = (
+    """ALTER TABLE files ADD COLUMN inode INTEGER""",
+    """CREATE TABLE multipart_uploads (
+        bucket TEXT NOT NULL,
+        key TEXT NOT NULL,
+        upload_id TEXT NOT NULL,
+        part_size INTEGER NOT NULL,
+        size INTEGER,
+        mtime_ns INTEGER,
+        PRIMARY KEY (bucket, key))""",
+    """ALTER TABLE files ADD COLUMN record TEXT""",
+)
+
+cache_schema = (
+    """CREATE TABLE IF NOT EXISTS objects (
+        bucket TEXT NOT NULL,
+        key TEXT NOT NULL,
+        etag TEXT NOT NULL,
+        content BLOB NOT NULL,
+        PRIMARY KEY (bucket, key))""",
+    """CREATE TABLE IF NOT EXISTS tiles (
+        bucket TEXT NOT NULL,
+        thumbnail TEXT NOT NULL,
+        tile BLOB NOT NULL,
+        PRIMARY KEY (bucket, thumbnail))""",
+)
+
+content_schema = (
+    """CREATE TABLE IF NOT EXISTS contents (
+        sha256 TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        record TEXT NOT NULL,
+        updated REAL,
+        PRIMARY KEY (sha256, bucket))""",
+)
+
+_states = {}
+
+def get_state(path):
+    """Returns the (cached) state of the given album folder.
+        A connection is never shared with a forked worker process."""
+    key = (os.getpid(), os.path.abspath(path))
+    if key not in _states:
+        _states[key] = LocalState(key[1])
+    return _states[key]
+
+def get_object_cache():
+    """Returns the (cached) local copies of the downloaded manifest objects"""
+    key = (os.getpid(), cache_file)
+    if key not in _states:
+        _states[key] = ObjectCache(os.path.join(user_state_dir, cache_file))
+    return _states[key]
+
+def get_content_index():
+    """Returns the (cached) index of the uploaded contents of all the albums"""
+    key = (os.getpid(), content_file)
+    if key not in _states:
+        _states[key] = ContentIndex(os.path.join(user_state_dir, content_file))
+    return _states[key]
+
+def read_legacy_hash_file(config_path):
+    """Reads the album name and the (filename, hash) pairs from an old config file.
+        A damaged file gives back as much as could be read."""
+    album = ""
+    hashes = {}
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_path)
+    except configparser.Error as e:
+        return album, hashes
+    if config.has_section(legacy_hash_album):
+        album = config.get(legacy_hash_album, legacy_hash_album, fallback = "").lower()
+    if config.has_section(legacy_hash_photos):
+        for option in config.options(legacy_hash_photos):
+            try:
+                hashes[option.lower()] = config.get(legacy_hash_photos, option).lower()
+            except configparser.Error as e:
+                pass
+    return album, hashes
+
+class LocalState():
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(os.path.join(path, state_file), check_same_thread = False)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            for statement in schema:
+                self._connection.execute(statement)
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            for statement in migrations[version:]:
+                self._connection.execute(statement)
+            self._connection.execute("PRAGMA user_version = %d" % len(migrations))
+        self.migrate_legacy_hash_file()
+
+    def migrate_legacy_hash_file(self):
+        """Moves the content of the old config file into the database"""
+        config_path = os.path.join(self._path, legacy_hash_file)
+        if not os.path.isfile(config_path):
+            return
+        album, hashes = read_legacy_hash_file(config_path)
+        with self._lock, self._connection:
+            if album and not self.get_album():
+                self.set_album(album)
+            now = time.time()
+            self._connection.executemany(
+                """INSERT OR IGNORE INTO files (filename, sha256, original, thumbnail, manifest, updated)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                [(file_name, sha256, uploaded, uploaded, uploaded, now) for file_name, sha256 in hashes.items()])
+        os.replace(config_path, config_path + ".bak")
+
+    def get_album(self):
+        """Returns the album name of the folder or empty string"""
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM settings WHERE key = ?", (album_key,)).fetchone()
+        return row[0] if row else ""
+
+    def set_album(self, album_name):
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                    (album_key, album_name))
+
+    def clear(self):
+        """Forgets the album and all the uploaded files"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM settings")
+            self._connection.execute("DELETE FROM files")
+
+    def get_uploaded_hashes(self):
+        """Returns the (filename, hash) pairs of the completely uploaded files"""
+        with self._lock:
+            rows = self._connection.execute(
+                    "SELECT filename, sha256 FROM files WHERE original = ? AND thumbnail = ? AND manifest = ?",
+                    (uploaded, uploaded, uploaded)).fetchall()
+        return {row['filename']: row['sha256'] for row in rows}
+
+    def get_uploaded_file_names(self):
+        return list(self.get_uploaded_hashes())
+
+    def get_file(self, file_name):
+        """Returns the record of the given file or None"""
+        with self._lock:
+            return self._connection.execute("SELECT * FROM files WHERE filename = ?", (file_name,)).fetchone()
+
+    def get_cached_hash(self, file_name, size, mtime_ns, inode):
+        """Returns the recorded hash of the file if its fingerprint hasn't changed"""
+        record = self.get_file(file_name)
+        if record and (record['size'], record['mtime_ns'], record['inode']) == (size, mtime_ns, inode):
+            return record['sha256']
+        return None
+
+    def set_file(self, file_name, size, mtime_ns, inode, sha256):
+        """Records a file with its fingerprint (size, mtime, inode) and hash.
+            If the file is new or its content has changed, none of its objects
+            count as uploaded."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                """INSERT INTO files (filename, size, mtime_ns, inode, sha256, updated) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (filename) DO UPDATE SET
+                        original = CASE WHEN sha256 IS excluded.sha256 THEN original ELSE 0 END,
+                        thumbnail = CASE WHEN sha256 IS excluded.sha256 THEN thumbnail ELSE 0 END,
+                        manifest = CASE WHEN sha256 IS excluded.sha256 THEN manifest ELSE 0 END,
+                        record = CASE WHEN sha256 IS excluded.sha256 THEN record ELSE NULL END,
+                        size = excluded.size, mtime_ns = excluded.mtime_ns, inode = excluded.inode,
+                        sha256 = excluded.sha256, updated = excluded.updated""",
+                (file_name, size, mtime_ns, inode, sha256, time.time()))
+
+    def set_record(self, file_name, record):
+        """Saves the manifest record of the file, it is merged into the manifest
+            without preparing the file again if the run is interrupted"""
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE files SET record = ? WHERE filename = ?",
+                    (json.dumps(record, ensure_ascii = False), file_name))
+
+    def get_record(self, file_name):
+        """Returns the saved manifest record of the file or None"""
+        row = self.get_file(file_name)
+        return json.loads(row['record']) if row and row['record'] else None
+
+    def get_finished_stages(self, file_name, size, mtime_ns, inode):
+        """Returns the uploaded objects of the file if it hasn't changed since"""
+        record = self.get_file(file_name)
+        if record is None or not self.get_cached_hash(file_name, size, mtime_ns, inode):
+            return ()
+        return tuple(stage for stage in stages if record[stage] == uploaded)
+
+    def set_uploaded(self, file_names, *objects):
+        """Marks the given objects (original, thumbnail, manifest) of the files uploaded"""
+        columns = ", ".join("%s = %d" % (stage, uploaded) for stage in stages if stage in objects)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE files SET %s, updated = ? WHERE filename = ?" % columns,
+                [(time.time(), file_name) for file_name in file_names])
+
+    def set_not_uploaded(self, file_names, *objects):
+        """Marks the given objects of the files not uploaded"""
+        columns = ", ".join("%s = %d" % (stage, not_uploaded) for stage in stages if stage in objects)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE files SET %s, updated = ? WHERE filename = ?" % columns,
+                [(time.time(), file_name) for file_name in file_names])
+
+    def get_multipart_upload(self, bucket, key):
+        """Returns the unfinished multipart upload of the key or None"""
+        with self._lock:
+            return self._connection.execute("SELECT * FROM multipart_uploads WHERE bucket = ? AND key = ?",
+                    (bucket, key)).fetchone()
+
+    def set_multipart_upload(self, bucket, key, upload_id, part_size, size, mtime_ns):
+        """Records a started multipart upload with the fingerprint of its file"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                """INSERT OR REPLACE INTO multipart_uploads (bucket, key, upload_id, part_size, size, mtime_ns)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                (bucket, key, upload_id, part_size, size, mtime_ns))
+
+    def clear_multipart_upload(self, bucket, key):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM multipart_uploads WHERE bucket = ? AND key = ?", (bucket, key))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+        _states.pop((os.getpid(), self._path), None)
+
+class ObjectCache():
+    """Local copies of downloaded objects with their ETag, so an object is
+        downloaded again only if it has changed in the bucket."""
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok = True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread = False)
+        with self._connection:
+            for statement in cache_schema:
+                self._connection.execute(statement)
+
+    def get(self, bucket, key):
+        """Returns the (etag, content) of the cached object or None"""
+        with self._lock:
+            return self._connection.execute("SELECT etag, content FROM objects WHERE bucket = ? AND key = ?",
+                    (bucket, key)).fetchone()
+
+    def set(self, bucket, key, etag, content):
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO objects (bucket, key, etag, content) VALUES (?, ?, ?, ?)",
+                    (bucket, key, etag, content))
+
+    def get_tile(self, bucket, thumbnail):
+        """Returns the sprite tile made from the given thumbnail or None"""
+        with self._lock:
+            row = self._connection.execute("SELECT tile FROM tiles WHERE bucket = ? AND thumbnail = ?",
+                    (bucket, thumbnail)).fetchone()
+        return row[0] if row else None
+
+    def set_tile(self, bucket, thumbnail, tile):
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO tiles (bucket, thumbnail, tile) VALUES (?, ?, ?)",
+                    (bucket, thumbnail, tile))
+
+class ContentIndex():
+    """Where the content of a file (by its sha256) has been uploaded: the bucket
+        and the manifest record of the file, which names its objects (original,
+        thumbnail, renditions) and holds its metadata."""
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok = True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread = False)
+        with self._connection:
+            for statement in content_schema:
+                self._connection.execute(statement)
+
+    def get(self, sha256, bucket):
+        """Returns the (bucket, record) of the content, preferably from the given bucket, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                    "SELECT bucket, record FROM contents WHERE sha256 = ? ORDER BY bucket = ? DESC, updated DESC",
+                    (sha256, bucket)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def add(self, sha256, bucket, record):
+        """Records the content uploaded under the record. The objects of a src hold
+            only its latest content, so the older contents of the src are forgotten."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                    "DELETE FROM contents WHERE bucket = ? AND json_extract(record, '$.src') = ? AND sha256 != ?",
+                    (bucket, record['src'], sha256))
+            self._connection.execute("INSERT OR REPLACE INTO contents (sha256, bucket, record, updated) VALUES (?, ?, ?, ?)",
+                    (sha256, bucket, json.dumps(record, ensure_ascii = False), time.time()))
+
+    def remove(self, sha256, bucket):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM contents WHERE sha256 = ? AND bucket = ?", (sha256, bucket))
+
+    def remove_bucket(self, bucket):
+        """Forgets the contents of a bucket which doesn't exist any more"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM contents WHERE bucket = ?", (bucket,))
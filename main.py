@@ -1,34 +1,88 @@
-from amazonUploader import AmazonUploader
-import os
-import argparse
-
-parser = argparse.ArgumentParser(description = 'Upload to Amazon')
-parser.add_argument('-album', type = str, help = 'Album name')
-parser.add_argument('-thumbnail', action = 'store_true', help = 'Update thumbnails')
-parser.add_argument('-update', action = 'store_true', help = 'Update fronend files')
-args = parser.parse_args()
-
-def getFolder():
-    return os.getcwd()
-
-def getAlbum():
-    """Get the album name for photos - get from argument list or calculate from the folder name"""
-    return args.album if args.album else os.path.basename(getFolder())
-
-#def is_valid_path(path):
-#    """Checks if the given path is valid or not"""
-#    return os.path.exists(path)
-
-album = getAlbum()
-
-def main():
-    uploader = AmazonUploader()
-    if args.thumbnail:
-        uploader.update_with_thumbnails(getFolder(), getAlbum())
-    elif args.update:
-        uploader.update_view(getFolder(), getAlbum())
-    else:
-        uploader.upload_all(getFolder(), getAlbum())
-
-if __name__ == "__main__":
-    main()
+from amazonUploader import AmazonUploader
+from batchUploader import run_batch
+from runStats import stats
+import os
+import argparse
+import signal
+
+parser = argparse.ArgumentParser(description = 'Upload to Amazon')
+parser.add_argument('-album', type = str, help = 'Album name')
+parser.add_argument('-thumbnail', action = 'store_true', help = 'Make the missing and stale thumbnails again')
+parser.add_argument('-update', action = 'store_true', help = 'Update fronend files')
+parser.add_argument('-jobs', type = int, default = 1, help = 'Number of files processed in parallel')
+parser.add_argument('-changed', action = 'store_true', help = 'Upload again the files whose content has changed')
+parser.add_argument('-frame', type = float, help = 'The second of the videos used for their thumbnails')
+parser.add_argument('-quality', type = int, help = 'JPEG quality of the thumbnails (1-95)')
+parser.add_argument('-norenditions', action = 'store_true', help = 'Do not upload smaller renditions of the images')
+parser.add_argument('-webp', action = 'store_true', help = 'Upload WebP renditions too')
+parser.add_argument('-proxy', action = 'store_true', help = 'Upload web-friendly MP4 proxies of the videos (needs ffmpeg)')
+parser.add_argument('-reconcile', action = 'store_true', help = 'Check the uploaded files against the bucket before uploading')
+parser.add_argument('-watch', action = 'store_true', help = 'Keep watching the folder and upload the new files')
+parser.add_argument('-settle', type = float, default = 2.0, help = 'Seconds a new file must be unchanged before it is uploaded in watch mode')
+parser.add_argument('-batch', type = str, help = 'Upload every album folder under the given folder')
+parser.add_argument('-albums', type = int, default = 2, help = 'Number of albums uploaded in parallel in batch mode')
+parser.add_argument('-budget', type = int, default = 16, help = 'Number of S3 requests in flight of all the albums in batch mode')
+parser.add_argument('-stats', '--stats', action = 'store_true', help = 'Print the time of the stages and the S3 requests at the end (per album in batch mode)')
+parser.add_argument('-trace', type = str, help = 'Append a JSON line of every file (stage times, result) to the given file')
+parser.add_argument('-profile', type = str, help = 'Run under cProfile and save the profile into the given file (the worker processes are not profiled)')
+
+def getFolder():
+    return os.getcwd()
+
+def getAlbum(args):
+    """Get the album name for photos - get from argument list or calculate from the folder name"""
+    return args.album if args.album else os.path.basename(getFolder())
+
+#def is_valid_path(path):
+#    """Checks if the given path is valid or not"""
+#    return os.path.exists(path)
+
+def terminate(signum, frame):
+    """Stops the run the same way as Ctrl+C, so the uploaded data is saved"""
+    raise KeyboardInterrupt()
+
+def run(args):
+    uploader_args = {'jobs': args.jobs, 'detect_changes': args.changed, 'video_position': args.frame,
+            'thumb_quality': args.quality, 'renditions': not args.norenditions, 'webp': args.webp,
+            'proxies': args.proxy}
+    if args.batch:
+        run_batch(args.batch, args.albums, args.budget, args.stats, **uploader_args)
+        return
+    uploader = AmazonUploader(**uploader_args)
+    if args.thumbnail:
+        uploader.update_with_thumbnails(getFolder(), getAlbum(args))
+    elif args.update:
+        uploader.update_view(getFolder(), getAlbum(args))
+    else:
+        if args.reconcile:
+            uploader.reconcile(getFolder(), getAlbum(args))
+        if args.watch:
+            uploader.watch(getFolder(), getAlbum(args), args.settle)
+        else:
+            uploader.upload_all(getFolder(), getAlbum(args))
+
+def main(argv = None):
+    """The arguments are parsed here, so the module can be imported without side effects"""
+    args = parser.parse_args(argv)
+    signal.signal(signal.SIGTERM, terminate)
+    if args.trace:
+        stats.open_trace(args.trace)
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        if args.stats and not args.batch:
+            stats.print_summary()
+        stats.close()
+
+if __name__ == "__main__":
+    main()
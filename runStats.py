@@ -0,0 +1,117 @@
+"""
+Instrumentation of a run: the time spent in every stage of the pipeline,
+the S3 requests by operation, the bytes read and sent, and an optional
+JSON-lines trace with one line per file.
+The stages of a file are timed into its own timings dict (see measure), which
+travels with the file data from the worker processes, and are added to the
+stats when the file is done. The S3 requests are counted by the before-call
+event of the botocore clients.
+"""
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+class RunStats():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self.times = {} #stage: list of seconds
+        self.counters = {} #name: number
+        self.requests = {} #S3 operation: number
+        self._trace = None
+
+    def reset(self):
+        """Starts the stats again (the trace file is kept)"""
+        with self._lock:
+            self._start = time.monotonic()
+            self.times = {}
+            self.counters = {}
+            self.requests = {}
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.times.setdefault(stage, []).append(seconds)
+
+    def count(self, name, amount = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def watch_client(self, client):
+        """Counts the requests of the botocore client"""
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is not None:
+            events.register('before-call.s3', self._on_request)
+
+    def _on_request(self, model, params, **kwargs):
+        with self._lock:
+            self.requests[model.name] = self.requests.get(model.name, 0) + 1
+
+    def open_trace(self, file_path):
+        """Writes a JSON line of every finished file into the given file"""
+        self._trace = open(file_path, 'a', encoding = 'utf-8')
+
+    def add_file(self, file_name, size, timings, result):
+        """Adds the stage timings of a finished file (uploaded, failed, replayed, duplicate)"""
+        for stage, seconds in timings.items():
+            self.add_time(stage, seconds)
+        self.count('files_' + result)
+        self.count('bytes_read', size or 0)
+        if self._trace:
+            line = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'file': file_name, 'size': size, 'result': result,
+                    'stages': {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}}
+            with self._lock:
+                self._trace.write(json.dumps(line, ensure_ascii = False) + '\n')
+                self._trace.flush()
+
+    def close(self):
+        if self._trace:
+            self._trace.close()
+            self._trace = None
+
+    def get_summary(self):
+        with self._lock:
+            return {'seconds': time.monotonic() - self._start,
+                    'stages': {stage: {'count': len(values), 'total': sum(values),
+                            'p50': percentile(values, 50), 'p90': percentile(values, 90),
+                            'p99': percentile(values, 99), 'max': max(values)}
+                            for stage, values in self.times.items()},
+                    'counters': dict(self.counters),
+                    'requests': dict(self.requests)}
+
+    def print_summary(self):
+        summary = self.get_summary()
+        print('\nRun: %.1f s' % summary['seconds'])
+        print('%-20s %7s %9s %9s %9s %9s' % ('Stage', 'Count', 'Total s', 'p50 ms', 'p90 ms', 'Max ms'))
+        for stage, item in sorted(summary['stages'].items(), key = lambda item: -item[1]['total']):
+            print('%-20s %7d %9.2f %9.1f %9.1f %9.1f' % (stage, item['count'], item['total'],
+                    item['p50'] * 1000, item['p90'] * 1000, item['max'] * 1000))
+        requests = summary['requests']
+        print('S3 requests: %d (%s)' % (sum(requests.values()),
+                ', '.join('%s %d' % item for item in sorted(requests.items()))))
+        counters = summary['counters']
+        print('Files: %s' % ', '.join('%s %d' % (name[len('files_'):], value)
+                for name, value in sorted(counters.items()) if name.startswith('files_')))
+        print('Read: %.1f MB, sent: %.1f MB, retries: %d, throttled: %d' % (
+                counters.get('bytes_read', 0) / 1024 / 1024, counters.get('bytes_sent', 0) / 1024 / 1024,
+                counters.get('retries', 0), counters.get('throttled', 0)))
+
+#the stats of this process
+stats = RunStats()
+
+@contextmanager
+def measure(stage, timings = None):
+    """Times the block: into the timings dict of a file if it is given, otherwise into the stats"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if timings is None:
+            stats.add_time(stage, seconds)
+        else:
+            timings[stage] = timings.get(stage, 0) + seconds
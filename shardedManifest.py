@@ -0,0 +1,173 @@
+"""
+Sharded manifest of an album.
+Instead of one photos.json with all the records, the album has a small root
+index (manifest.json) and page files with at most page_size records each:
+
+manifest.json: {"version": 1, "count": 1234, "page_size": 500, "next_page": 3,
+        "pages": [{"key": "pages/0.json", "count": 500, "first": "20190821...", "last": "20190612..."}, ...]}
+
+The pages (and the records in them) are ordered by date_taken, newest first,
+like photos.json was. A new record goes into the page whose date range covers
+it, and a page which grows over page_size is split into two, so a merge
+rewrites only the pages it touched and the root index.
+"""
+
+root_file = "manifest.json"
+legacy_file = "photos.json"
+page_prefix = "pages/"
+page_size = 500
+manifest_version = 1
+
+def get_date_taken(record):
+    return str(record.get('date_taken', ''))
+
+def sort_records(records):
+    return sorted(records, key = lambda k: (get_date_taken(k), k.get('src', '')), reverse = True)
+
+class ShardedManifest():
+    def __init__(self, read, write, prepare_page = None):
+        """read(key) returns the parsed json content of the key or None if it doesn't exist,
+            write(key, content) saves the content as json under the key,
+            prepare_page(key, records) is called for every changed page before it is saved."""
+        self._read = read
+        self._write = write
+        self._prepare_page = prepare_page
+        self._root = None
+        self._pages = {}
+        self._changed = set()
+        self._src_pages = None #src: key of its page, made on the first merge
+
+    def exists(self):
+        return self._get_root() is not None
+
+    def _get_root(self):
+        if self._root is None:
+            self._root = self._read(root_file)
+        return self._root
+
+    def _get_or_create_root(self):
+        if self._get_root() is None:
+            self._root = {'version': manifest_version, 'count': 0, 'page_size': page_size,
+                    'next_page': 0, 'pages': []}
+        return self._root
+
+    def get_page(self, page):
+        """Returns the records of the given page (from the root index)"""
+        key = page['key']
+        if key not in self._pages:
+            self._pages[key] = self._read(key) or []
+        return self._pages[key]
+
+    def _new_page(self, records):
+        root = self._get_or_create_root()
+        key = "%s%d.json" % (page_prefix, root['next_page'])
+        root['next_page'] += 1
+        self._pages[key] = records
+        self._changed.add(key)
+        return {'key': key, 'count': 0, 'first': '', 'last': ''}
+
+    def _get_src_pages(self):
+        """Returns the page key of every record by its src. All the pages are
+            read once, the old record of a src can be on any page if its date
+            has changed."""
+        if self._src_pages is None:
+            self._src_pages = {}
+            for page in self._get_or_create_root()['pages']:
+                for record in self.get_page(page):
+                    self._src_pages[record['src']] = page['key']
+        return self._src_pages
+
+    def _find_insert_page(self, date_taken):
+        """Returns the index of the page where a record with the given date belongs to.
+            The empty pages (dropped by save) have no date range, they are skipped."""
+        pages = self._get_or_create_root()['pages']
+        for i, page in enumerate(pages):
+            if page['count'] and date_taken >= page['last']:
+                return i
+        for i in range(len(pages) - 1, -1, -1):
+            if pages[i]['count']:
+                return i
+        return len(pages) - 1
+
+    def _remove(self, src):
+        """Removes the record of the given src from its page"""
+        key = self._get_src_pages().pop(src, None)
+        if key is None:
+            return
+        pages = self._root['pages']
+        i = [page['key'] for page in pages].index(key)
+        self._pages[key] = [data for data in self.get_page(pages[i]) if data['src'] != src]
+        self._changed.add(key)
+        self._update_page(i)
+
+    def merge(self, records):
+        """Adds the records to the manifest - a new record replaces the old one
+            with the same src. Nothing is saved until save() is called."""
+        root = self._get_or_create_root()
+        for record in records:
+            self._remove(record['src'])
+            if not root['pages']:
+                root['pages'].append(self._new_page([]))
+            i = self._find_insert_page(get_date_taken(record))
+            key = root['pages'][i]['key']
+            self._pages[key] = sort_records(self.get_page(root['pages'][i]) + [record])
+            self._src_pages[record['src']] = key
+            self._changed.add(key)
+            self._update_page(i)
+
+    def _update_page(self, i):
+        """Refreshes the index data of the i-th page and splits it if it is too big"""
+        pages = self._root['pages']
+        records = self.get_page(pages[i])
+        limit = self._root.get('page_size', page_size)
+        if len(records) > limit:
+            half = len(records) // 2
+            self._pages[pages[i]['key']] = records[:half]
+            pages.insert(i + 1, self._new_page(records[half:]))
+            if self._src_pages is not None:
+                for record in records[half:]:
+                    self._src_pages[record['src']] = pages[i + 1]['key']
+            self._update_page(i + 1)
+            records = records[:half]
+        if records:
+            pages[i].update({'count': len(records),
+                    'first': get_date_taken(records[0]),
+                    'last': get_date_taken(records[-1])})
+        else:
+            pages[i].update({'count': 0, 'first': '', 'last': ''})
+
+    def save(self):
+        """Writes the changed pages, then the root index"""
+        if not self._changed:
+            return
+        root = self._root
+        #empty pages are dropped from the index
+        root['pages'] = [page for page in root['pages'] if page['count']]
+        for page in root['pages']:
+            if page['key'] in self._changed:
+                if self._prepare_page:
+                    self._prepare_page(page['key'], self._pages[page['key']])
+                self._write(page['key'], self._pages[page['key']])
+        root['count'] = sum(page['count'] for page in root['pages'])
+        self._write(root_file, root)
+        self._changed = set()
+
+    def records(self):
+        """Returns all the records, newest first"""
+        root = self._get_root()
+        if root is None:
+            return []
+        result = []
+        for page in root['pages']:
+            result.extend(self.get_page(page))
+        return result
+
+    def import_legacy(self, records):
+        """Creates the pages from the content of an old photos.json"""
+        for i, record in enumerate(sort_records(records)):
+            if i % page_size == 0:
+                self._get_or_create_root()['pages'].append(self._new_page([]))
+            self._pages[self._root['pages'][-1]['key']].append(record)
+        for i in range(len(self._root['pages'])):
+            self._update_page(i)
+        self._src_pages = None
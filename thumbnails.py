@@ -1,61 +1,292 @@
-from PIL import Image
-from fileInfo import *
-import os
-from moviepy.editor import *
-from io import BytesIO
-
-thumb_width = 500;
-thumb_prefix = "tbnl_" 
-thumb_ext = ".jpg"
-
-def calculate_size(image):
-    width, height = image.size
-    if width < height:
-        return thumb_width, int(height * thumb_width / width)
-    else:
-        return int(width * thumb_width / height), thumb_width
-
-def resize_and_save_image(image):
-    image.thumbnail(calculate_size(image), Image.ANTIALIAS)
-    output = BytesIO()
-    image.save(output, 'JPEG')
-    #go back to the begining of the file
-    output.seek(0)
-    return output
-
-def save_image_thumbnail(original_file_path):
-    im = Image.open(original_file_path)
-    #for png transparency:
-    im = im.convert('RGB')
-    #rotation according to the exif orientation data
-    orientation = get_orientation(original_file_path)
-    if orientation == 3:
-        im = im.rotate(180)
-    if orientation == 6:
-        im = im.rotate(270, expand = True)
-    if orientation == 8:
-        im = im.rotate(90, expand = True)
-    return resize_and_save_image(im)
-
-def save_video_thumbnail(original_file_path):
-    """Saves thumbnail of the given video under the given name"""
-    clip = VideoFileClip(original_file_path)
-    im = Image.fromarray(clip.get_frame(0))
-    return resize_and_save_image(im)
-    
-def get_thumbnail_name(file_name):
-    orig_name, orig_ext= os.path.splitext(file_name.lower())
-    thumbnail_name = thumb_prefix + orig_name + thumb_ext
-    return thumbnail_name
-
-def generate_thubnail(full_path, file_name):
-    orig_name, orig_ext= os.path.splitext(file_name.lower())
-    
-    try:
-        if orig_ext in image_ext:
-            return save_image_thumbnail(full_path)
-        elif orig_ext in video_ext:
-            return save_video_thumbnail(full_path)
-    except Exception as e:
-        print(e)
-        print("no thumbnail for file: %s" %full_path)
\ No newline at end of file
+from PIL import Image, ImageOps
+from fileInfo import *
+import math
+import os
+from io import BytesIO
+import videoBackend
+
+thumb_width = 500;
+thumb_prefix = "tbnl_" 
+thumb_ext = ".jpg"
+thumb_quality = 85 #JPEG quality of the thumbnails
+thumb_spec_version = 1 #raise it if the way the thumbnails are made changes, so they are made again
+rendition_sizes = (320, 800, 1600, 2560) #longer side of the renditions of an image
+rendition_prefix = "r%d_"
+rendition_ext = ".jpg", ".jpeg", ".png" #gifs are shown as they are, to keep the animation
+placeholder_size = 32 #the placeholder (BlurHash) is calculated from an image of this size
+placeholder_components = 4, 3 #horizontal and vertical components of the BlurHash
+base83_chars = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+sprite_tile_size = 96 #size of the square thumbnails on the sprite sheets
+sprite_columns = 8
+sprite_rows = 8 #a sheet has sprite_columns * sprite_rows tiles
+sprite_prefix = "sprites/"
+video_thumb_position = 1.0 #the thumbnail of a video is its frame at this second - the first frame is often black
+proxy_prefix = "proxy_" #the web-friendly MP4 of a video played by the gallery
+proxy_ext = ".mp4"
+proxy_height = 720 #the proxy is never higher than this
+proxy_bitrate = 2500 #kbit/s cap of the video stream of the proxy
+poster_prefix = "poster_" #the frame shown before the proxy is played
+#transpose operations which turn the image according to its exif orientation
+orientation_transposes = {
+        2: (Image.FLIP_LEFT_RIGHT,),
+        3: (Image.ROTATE_180,),
+        4: (Image.FLIP_TOP_BOTTOM,),
+        5: (Image.ROTATE_270, Image.FLIP_LEFT_RIGHT),
+        6: (Image.ROTATE_270,),
+        7: (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
+        8: (Image.ROTATE_90,),
+        }
+
+def calculate_size(image):
+    width, height = image.size
+    if width < height:
+        return thumb_width, int(height * thumb_width / width)
+    else:
+        return int(width * thumb_width / height), thumb_width
+
+def transpose_image(image, orientation):
+    """Turns the image according to the exif orientation data"""
+    for method in orientation_transposes.get(orientation, ()):
+        image = image.transpose(method)
+    return image
+
+def resize_and_save_image(image, orientation = 1, quality = None):
+    """Shrinks the image to the thumbnail size, then turns it. Turning after
+        the resize touches only the small image - the size is calculated from
+        the shorter side, which doesn't change by turning."""
+    image.thumbnail(calculate_size(image), Image.LANCZOS)
+    image = transpose_image(image, orientation)
+    output = BytesIO()
+    image.save(output, 'JPEG', quality = quality or thumb_quality, optimize = True, progressive = True)
+    #go back to the begining of the file
+    output.seek(0)
+    return output
+
+def open_image(original_file_path, media = None):
+    """Returns the opened (not yet decoded) image and its orientation.
+        If the MediaInfo of the image is given, its image and orientation are used."""
+    if media is not None and media.image is not None:
+        return media.image, media.orientation
+    return Image.open(original_file_path), get_orientation(original_file_path)
+
+def save_image_thumbnail(original_file_path, media = None, quality = None):
+    """Makes the thumbnail of an image. If the MediaInfo of the image is given,
+        its already opened image and orientation are used.
+        JPEGs are decoded in draft mode: the decoder scales them down (by 1/2, 1/4
+        or 1/8) to the smallest size still not under the thumbnail size, so a
+        big photo is never decoded in full."""
+    im, orientation = open_image(original_file_path, media)
+    im.draft('RGB', calculate_size(im))
+    #for png transparency:
+    im = im.convert('RGB')
+    return resize_and_save_image(im, orientation, quality)
+
+def save_video_thumbnail(original_file_path, media = None, position = None, quality = None):
+    """Saves thumbnail of the given video under the given name
+        The frame at the given position is used, or at the middle of the video
+        if it is shorter than that."""
+    if position is None:
+        position = video_thumb_position
+    if media is not None and media.duration and position >= media.duration:
+        position = media.duration / 2
+    im = videoBackend.extract_frame(original_file_path, position)
+    if im is None and position > 0:
+        im = videoBackend.extract_frame(original_file_path, 0)
+    if im is None:
+        raise ValueError("ffmpeg could not extract a frame")
+    return resize_and_save_image(im.convert('RGB'), quality = quality)
+    
+def get_thumb_spec(quality = None):
+    """Returns the spec of the thumbnails made by the current settings, like "1-500-85".
+        It is saved in the manifest records, a thumbnail of another spec is stale."""
+    return "%d-%d-%d" % (thumb_spec_version, thumb_width, quality or thumb_quality)
+
+def get_thumbnail_name(file_name):
+    orig_name, orig_ext= os.path.splitext(file_name.lower())
+    thumbnail_name = thumb_prefix + orig_name + thumb_ext
+    return thumbnail_name
+
+def get_rendition_name(file_name, size, ext = ".jpg"):
+    orig_name, orig_ext= os.path.splitext(file_name.lower())
+    return (rendition_prefix % size) + orig_name + ext
+
+def get_proxy_name(file_name):
+    orig_name, orig_ext= os.path.splitext(file_name.lower())
+    return proxy_prefix + orig_name + proxy_ext
+
+def get_poster_name(file_name):
+    orig_name, orig_ext= os.path.splitext(file_name.lower())
+    return poster_prefix + orig_name + thumb_ext
+
+def has_renditions(file_name):
+    return file_name.lower().endswith(rendition_ext)
+
+def save_image(image, image_format, quality = None):
+    output = BytesIO()
+    if image_format == 'WEBP':
+        image.save(output, image_format, quality = quality or thumb_quality, method = 4)
+    else:
+        image.save(output, image_format, quality = quality or thumb_quality, optimize = True, progressive = True)
+    return output.getvalue()
+
+def save_image_renditions(original_file_path, file_name, media = None, quality = None, webp = False):
+    """Makes the thumbnail and the renditions of an image from one decode.
+        Only the renditions smaller than the original are made. The image is
+        decoded (in draft mode) at the size needed by the biggest one, and every
+        rendition is shrunk from the previous, bigger one.
+        Returns the thumbnail, the rendition data for the manifest and the list of
+        (name, content, content type) of the rendition files."""
+    im, orientation = open_image(original_file_path, media)
+    width, height = im.size
+    sizes = sorted([size for size in rendition_sizes if size < max(width, height)], reverse = True)
+    scale = thumb_width / min(width, height)
+    if sizes:
+        scale = max(scale, sizes[0] / max(width, height))
+    im.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+    #for png transparency:
+    im = im.convert('RGB')
+    thumbnail = resize_and_save_image(im.copy(), orientation, quality)
+
+    renditions = []
+    files = []
+    for size in sizes:
+        im.thumbnail((size, size), Image.LANCZOS)
+        rendition = transpose_image(im, orientation)
+        data = {'w': rendition.size[0], 'h': rendition.size[1], 'src': get_rendition_name(file_name, size)}
+        files.append((data['src'], save_image(rendition, 'JPEG', quality), 'image/jpeg'))
+        if webp:
+            data['webp'] = get_rendition_name(file_name, size, ".webp")
+            files.append((data['webp'], save_image(rendition, 'WEBP', quality), 'image/webp'))
+        renditions.append(data)
+    #smallest first - as in srcset
+    renditions.reverse()
+    return thumbnail, renditions, files
+
+def generate_renditions(full_path, file_name, media = None, quality = None, webp = False):
+    """Returns the thumbnail, the rendition data and the rendition files of an image.
+        Other files get only a thumbnail."""
+    if not has_renditions(file_name):
+        return generate_thubnail(full_path, file_name, media, quality = quality), [], []
+    try:
+        return save_image_renditions(full_path, file_name, media, quality, webp)
+    except Exception as e:
+        print(e)
+        print("no renditions for file: %s" %full_path)
+    return None, [], []
+
+def generate_thubnail(full_path, file_name, media = None, video_position = None, quality = None):
+    orig_name, orig_ext= os.path.splitext(file_name.lower())
+    
+    try:
+        if orig_ext in image_ext:
+            return save_image_thumbnail(full_path, media, quality)
+        elif orig_ext in video_ext:
+            return save_video_thumbnail(full_path, media, video_position, quality)
+    except Exception as e:
+        print(e)
+        print("no thumbnail for file: %s" %full_path)
+
+def generate_proxy(full_path, file_name, proxy_path, position = None, quality = None):
+    """Transcodes the video into the proxy file and grabs its poster frame (at
+        full proxy size, the thumbnail is too small for the player).
+        Returns the proxy data for the manifest and the (name, content, content type)
+        of the poster, or None, None if ffmpeg failed."""
+    if not videoBackend.transcode_proxy(full_path, proxy_path, proxy_height, proxy_bitrate):
+        print("no proxy for file: %s" %full_path)
+        return None, None
+    info = videoBackend.probe(proxy_path)
+    proxy = {'src': get_proxy_name(file_name), 'w': info['width'], 'h': info['height']}
+    if position is None:
+        position = video_thumb_position
+    if info['duration'] and position >= info['duration']:
+        position = info['duration'] / 2
+    im = videoBackend.extract_frame(proxy_path, position)
+    if im is None:
+        return proxy, None
+    proxy['poster'] = get_poster_name(file_name)
+    return proxy, (proxy['poster'], save_image(im.convert('RGB'), 'JPEG', quality), 'image/jpeg')
+
+def make_sprite_tile(thumbnail):
+    """Returns the small square tile (JPEG) made from the given thumbnail (JPEG)"""
+    im = Image.open(BytesIO(thumbnail))
+    im.draft('RGB', (sprite_tile_size, sprite_tile_size))
+    tile = ImageOps.fit(im.convert('RGB'), (sprite_tile_size, sprite_tile_size), Image.LANCZOS)
+    return save_image(tile, 'JPEG', 90)
+
+def build_sprite_sheet(tiles):
+    """Puts the tiles (JPEG or None) onto a sheet row by row. The sheet always
+        has the full size, so the tile positions can be given in percent."""
+    sheet = Image.new('RGB', (sprite_columns * sprite_tile_size, sprite_rows * sprite_tile_size), '#333')
+    for i, tile in enumerate(tiles):
+        if tile is not None:
+            x, y = get_sprite_position(i)
+            sheet.paste(Image.open(BytesIO(tile)), (x * sprite_tile_size, y * sprite_tile_size))
+    return save_image(sheet, 'JPEG')
+
+def get_sprite_position(index):
+    """(column, row) of the index-th tile on its sheet"""
+    return index % sprite_columns, index // sprite_columns
+
+def encode_base83(value, length):
+    result = ""
+    for i in range(1, length + 1):
+        result += base83_chars[int(value) // (83 ** (length - i)) % 83]
+    return result
+
+def srgb_to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+def linear_to_srgb(value):
+    v = max(0, min(1, value))
+    return int(v * 12.92 * 255 + 0.5) if v <= 0.0031308 else int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+def sign_pow(value, exp):
+    return math.copysign(abs(value) ** exp, value)
+
+def encode_blurhash(image, x_components, y_components):
+    """BlurHash (https://blurha.sh) of a small RGB image: a ~30 character
+        string of its average colour and a few cosine components"""
+    width, height = image.size
+    pixels = [[srgb_to_linear(c) for c in pixel] for pixel in image.getdata()]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0
+            for y in range(height):
+                basis_y = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = normalisation * math.cos(math.pi * i * x / width) * basis_y
+                    pixel = pixels[y * width + x]
+                    r += basis * pixel[0]
+                    g += basis * pixel[1]
+                    b += basis * pixel[2]
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = encode_base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        actual_maximum = max(abs(c) for factor in ac for c in factor)
+        quantised_maximum = int(max(0, min(82, math.floor(actual_maximum * 166 - 0.5))))
+        maximum = (quantised_maximum + 1) / 166
+        result += encode_base83(quantised_maximum, 1)
+    else:
+        maximum = 1
+        result += encode_base83(0, 1)
+    result += encode_base83((linear_to_srgb(dc[0]) << 16) + (linear_to_srgb(dc[1]) << 8) + linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = [int(max(0, min(18, math.floor(sign_pow(c / maximum, 0.5) * 9 + 9.5)))) for c in factor]
+        result += encode_base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+def make_placeholder(thumbnail):
+    """Returns the BlurHash of the thumbnail (JPEG), which the gallery shows
+        until the image itself is loaded. The thumbnail is decoded in draft
+        mode, at 1/8 of its size."""
+    im = Image.open(BytesIO(thumbnail))
+    im.draft('RGB', (placeholder_size, placeholder_size))
+    im = im.convert('RGB')
+    im.thumbnail((placeholder_size, placeholder_size), Image.BILINEAR)
+    return encode_blurhash(im, *placeholder_components)
@@ -0,0 +1,235 @@
+"""
+Transfer layer of the uploads.
+- The files are uploaded with a TransferConfig chosen by their type: large videos
+  in big parts with more parts in parallel, photos mostly in one request.
+- The number of requests in flight is adaptive (AIMD): it is halved when S3
+  throttles (SlowDown/503) and raised by one after a run of successful requests.
+- In batch mode the albums are uploaded by more processes, they share a global
+  budget of requests in flight (a multiprocessing semaphore).
+- A failed request is retried a bounded number of times, after a random
+  (full jitter) exponential backoff.
+- The upload ID and the part size of a multipart upload are recorded in the
+  local state, so an interrupted upload continues with the missing parts.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fileInfo import is_video_file
+from runStats import stats
+import botocore.exceptions
+import os
+import random
+import threading
+import time
+
+#the fields of boto3's TransferConfig used here, without importing boto3
+TransferConfig = namedtuple('TransferConfig', ('multipart_threshold', 'multipart_chunksize', 'max_concurrency'))
+MB = 1024 * 1024
+video_transfer_config = TransferConfig(multipart_threshold = 32 * MB, multipart_chunksize = 16 * MB, max_concurrency = 4)
+image_transfer_config = TransferConfig(multipart_threshold = 16 * MB, multipart_chunksize = 8 * MB, max_concurrency = 2)
+max_parts = 10000 #S3 limit of the parts of a multipart upload
+
+max_attempts = 6
+base_backoff = 0.5 #seconds
+max_backoff = 20
+throttling_codes = ("SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded", "503")
+transient_codes = ("RequestTimeout", "RequestTimeTooSkewed", "InternalError", "ServiceUnavailable", "500", "502", "504")
+transient_errors = (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError,
+        botocore.exceptions.ReadTimeoutError, botocore.exceptions.IncompleteReadError)
+global_slots = None #requests in flight of all the processes, see set_global_slots
+
+def set_global_slots(slots):
+    """Sets the semaphore shared by the upload processes of a batch"""
+    global global_slots
+    global_slots = slots
+
+def create_client(max_connections):
+    """S3 client of the transfers. botocore doesn't retry on its own, so
+        every throttled request reaches the adaptive limit."""
+    import boto3
+    import botocore.config
+    config = botocore.config.Config(retries = {'mode': 'standard', 'max_attempts': 1},
+            max_pool_connections = max_connections)
+    client = boto3.client('s3', config = config)
+    stats.watch_client(client)
+    return client
+
+def get_transfer_config(file_name):
+    return video_transfer_config if is_video_file(file_name) else image_transfer_config
+
+def get_part_size(size, config):
+    """Part size of the file: the chunk size of the config, or bigger if the file would have too many parts"""
+    return max(config.multipart_chunksize, -(-size // max_parts))
+
+def get_error_code(error):
+    return error.response.get('Error', {}).get('Code', '')
+
+def is_throttled(error):
+    return get_error_code(error) in throttling_codes \
+            or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 503
+
+def is_transient(error):
+    return get_error_code(error) in transient_codes \
+            or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in (500, 502, 504)
+
+class AdaptiveLimit():
+    """Limit of the requests in flight: halved on throttling,
+        raised by one after `limit` successful requests in a row"""
+    def __init__(self, limit, maximum):
+        self.limit = max(1, limit)
+        self.maximum = max(self.limit, maximum)
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+        if global_slots is not None:
+            global_slots.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        if global_slots is not None:
+            global_slots.release()
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def succeeded(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify()
+
+    def throttled(self):
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+class Transfer():
+    def __init__(self, client, concurrency = 4, max_concurrency = 32):
+        """client: the S3 client (see create_client)
+            concurrency: initial limit of the requests in flight, it can grow up to max_concurrency"""
+        self.client = client
+        self.limit = AdaptiveLimit(concurrency, max_concurrency)
+
+    def call(self, method, **kwargs):
+        """Calls the client method with the limit and retries. The arguments are
+            sent again on retry, so a body must be bytes, not a stream."""
+        for attempt in range(max_attempts):
+            try:
+                with self.limit:
+                    result = method(**kwargs)
+                self.limit.succeeded()
+                return result
+            except botocore.exceptions.ClientError as e:
+                if is_throttled(e):
+                    self.limit.throttled()
+                    stats.count('throttled')
+                elif not is_transient(e):
+                    raise
+                if attempt + 1 == max_attempts:
+                    raise
+            except transient_errors as e:
+                if attempt + 1 == max_attempts:
+                    raise
+            stats.count('retries')
+            time.sleep(random.uniform(0, min(max_backoff, base_backoff * 2 ** attempt)))
+
+    def put_object(self, bucket_name, key, body, **extra_args):
+        response = self.call(self.client.put_object, Bucket = bucket_name, Key = key, Body = body, **extra_args)
+        stats.count('bytes_sent', len(body))
+        return response
+
+    def upload_file(self, file_path, bucket_name, key, extra_args = None, callback = None, state = None,
+            config = None):
+        """Uploads the file in one request or, above the multipart threshold, in parts.
+            The multipart uploads are resumable if the local state is given."""
+        extra_args = extra_args or {}
+        config = config or get_transfer_config(key)
+        size = os.path.getsize(file_path)
+        if size < config.multipart_threshold:
+            with open(file_path, 'rb') as f:
+                body = f.read()
+            response = self.put_object(bucket_name, key, body, **extra_args)
+            if callback:
+                callback(size)
+            return response.get('ETag')
+        return self.upload_multipart(file_path, bucket_name, key, extra_args, callback, state, config)
+
+    def resume_multipart(self, file_path, bucket_name, key, state):
+        """Returns the recorded upload of the file, its part size and its uploaded parts
+            ({number: (etag, size)}), or None if it can't be continued"""
+        record = state.get_multipart_upload(bucket_name, key) if state else None
+        if record is None:
+            return None
+        stat = os.stat(file_path)
+        if (record['size'], record['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            parts = {}
+            try:
+                paginator = self.client.get_paginator('list_parts')
+                for page in paginator.paginate(Bucket = bucket_name, Key = key, UploadId = record['upload_id']):
+                    for part in page.get('Parts', []):
+                        parts[part['PartNumber']] = (part['ETag'], part['Size'])
+                return record['upload_id'], record['part_size'], parts
+            except botocore.exceptions.ClientError as e:
+                if get_error_code(e) != 'NoSuchUpload':
+                    raise
+        else:
+            #the file has changed since, its parts are useless
+            try:
+                self.client.abort_multipart_upload(Bucket = bucket_name, Key = key, UploadId = record['upload_id'])
+            except botocore.exceptions.ClientError as e:
+                pass
+        state.clear_multipart_upload(bucket_name, key)
+        return None
+
+    def upload_part(self, file_path, bucket_name, key, upload_id, number, offset, length, callback):
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            body = f.read(length)
+        response = self.call(self.client.upload_part, Bucket = bucket_name, Key = key, UploadId = upload_id,
+                PartNumber = number, Body = body)
+        stats.count('bytes_sent', length)
+        if callback:
+            callback(length)
+        return number, response['ETag']
+
+    def upload_multipart(self, file_path, bucket_name, key, extra_args, callback, state, config):
+        stat = os.stat(file_path)
+        resumed = self.resume_multipart(file_path, bucket_name, key, state)
+        if resumed:
+            upload_id, part_size, parts = resumed
+        else:
+            part_size = get_part_size(stat.st_size, config)
+            upload_id = self.call(self.client.create_multipart_upload, Bucket = bucket_name, Key = key,
+                    **extra_args)['UploadId']
+            parts = {}
+            if state:
+                state.set_multipart_upload(bucket_name, key, upload_id, part_size, stat.st_size, stat.st_mtime_ns)
+        etags = {}
+        missing = []
+        for number, offset in enumerate(range(0, stat.st_size, part_size), 1):
+            length = min(part_size, stat.st_size - offset)
+            if number in parts and parts[number][1] == length:
+                etags[number] = parts[number][0]
+                if callback:
+                    callback(length)
+            else:
+                missing.append((number, offset, length))
+        with ThreadPoolExecutor(max_workers = config.max_concurrency) as pool:
+            futures = [pool.submit(self.upload_part, file_path, bucket_name, key, upload_id,
+                    number, offset, length, callback) for number, offset, length in missing]
+            for future in futures:
+                number, etag = future.result()
+                etags[number] = etag
+        response = self.call(self.client.complete_multipart_upload, Bucket = bucket_name, Key = key,
+                UploadId = upload_id,
+                MultipartUpload = {'Parts': [{'PartNumber': n, 'ETag': etags[n]} for n in sorted(etags)]})
+        if state:
+            state.clear_multipart_upload(bucket_name, key)
+        return response.get('ETag')
@@ -0,0 +1,91 @@
+"""
+Video backend based on the ffprobe and ffmpeg command line tools.
+ffprobe reads all the metadata of a video in one call, ffmpeg extracts one frame
+with a fast seek and pipes it straight into PIL (no temporary files), and
+transcodes the videos into web-friendly proxies for the gallery.
+"""
+from io import BytesIO
+from PIL import Image
+import json
+import subprocess
+
+zero_creation_time = "0000-00-00 00:00:00"
+
+def run_ffprobe(file_path):
+    """Returns the format and stream data of the given video by ffprobe"""
+    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err =  p.communicate()
+    return json.loads(out.decode('utf-8'))
+
+def get_rotation(stream):
+    """Rotation of the video stream - older files keep it in the tags, newer ones in the side data"""
+    rotation = stream.get('tags', {}).get('rotate')
+    if rotation is None:
+        for side_data in stream.get('side_data_list', []):
+            if 'rotation' in side_data:
+                rotation = side_data['rotation']
+    return int(float(rotation or 0)) % 360
+
+def probe(file_path):
+    """Returns the duration, creation time ("YYYY-mm-dd HH:MM:SS"), rotation
+        and size of the given video. If ffprobe is not available or can't
+        read the file, the values are empty."""
+    result = {'duration': 0, 'creation_time': zero_creation_time, 'rotation': 0, 'width': 0, 'height': 0}
+    try:
+        out = run_ffprobe(file_path)
+    except (FileNotFoundError, ValueError) as e:
+        #if ffprobe.exe is not available or its output is invalid
+        return result
+    file_format = out.get('format', {})
+    creation_time = file_format.get('tags', {}).get('creation_time')
+    if creation_time:
+        #2019-08-14T17:56:07.000000Z
+        result['creation_time'] = creation_time.replace('T', ' ')[:19]
+    result['duration'] = float(file_format.get('duration', 0))
+    for stream in out.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            result['width'] = stream.get('width', 0)
+            result['height'] = stream.get('height', 0)
+            result['rotation'] = get_rotation(stream)
+            break
+    return result
+
+def extract_frame(file_path, position = 0):
+    """Returns the frame of the video at the given position (in seconds) as a PIL image.
+        The seek is done before opening the input, so ffmpeg jumps to the nearest
+        keyframe instead of decoding the video from the beginning.
+        ffmpeg applies the rotation of the video to the frame."""
+    cmd = ['ffmpeg', '-v', 'error', '-ss', '%.3f' % position, '-i', file_path,
+            '-frames:v', '1', '-f', 'image2pipe', '-c:v', 'bmp', '-']
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    if not out:
+        return None
+    im = Image.open(BytesIO(out))
+    im.load()
+    return im
+
+def transcode_proxy(file_path, output_path, height = 720, bitrate = 2500, audio_bitrate = 128, crf = 23):
+    """Transcodes the video into an H.264/AAC MP4 which every browser can play:
+        at most the given height (it is never scaled up), the video bitrate capped
+        at the given kbit/s, and the index (moov atom) moved to the front of the
+        file (+faststart), so the playback starts before the whole file is loaded.
+        ffmpeg applies the rotation of the video. Returns False if ffmpeg is not
+        available or failed."""
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-i', file_path,
+            '-vf', "scale=-2:'min(%d,ih)':flags=lanczos,format=yuv420p" % height,
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'high', '-crf', str(crf),
+            '-maxrate', '%dk' % bitrate, '-bufsize', '%dk' % (bitrate * 2),
+            '-c:a', 'aac', '-b:a', '%dk' % audio_bitrate, '-ac', '2',
+            '-movflags', '+faststart', '-f', 'mp4', output_path]
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        #if ffmpeg.exe is not available
+        return False
+    out, err = p.communicate()
+    if p.returncode != 0:
+        print(err.decode('utf-8', 'replace').strip())
+        return False
+    return True